@@ -0,0 +1,154 @@
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+import metrics
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 256))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))  # sekundy
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.92))  # podobieństwo kosinusowe
+
+
+def normalize_query(query: str) -> str:
+    # "Czy Galaxy Z Flip 6 obsługuje Dual SIM?" == "czy galaxy z flip 6 obsługuje dual sim"
+    query = unicodedata.normalize("NFC", query).lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ?!.,;:")
+
+
+def query_numbers(query: str) -> frozenset:
+    # "S24" i "S25", "8 GB" i "12 GB" - pytania różniące się tylko liczbą to różne pytania
+    return frozenset(re.findall(r"\d+(?:[.,]\d+)?", query))
+
+
+class AnswerCache:
+    """Cache odpowiedzi: najpierw dokładne trafienie po znormalizowanym pytaniu,
+    potem najbliższy sąsiad po embeddingu pytania powyżej `similarity_threshold`, ale tylko
+    wśród pytań o te same encje (`entities_fn`: wymienione modele, liczby).
+
+    Wpisy wypadają po `ttl` sekundach albo jako najdawniej używane (LRU) po przekroczeniu
+    `max_entries`. Cały cache jest czyszczony, gdy `version_fn()` zwróci inną wersję indeksu.
+    `get` zwraca też wersję, na której liczona będzie odpowiedź - `put` z inną wersją niż bieżąca
+    nic nie zapisuje, żeby odpowiedź ze starego indeksu nie trafiła do cache nowego.
+    """
+
+    def __init__(self, embedder, version_fn: Callable[[], object], max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL, similarity_threshold: float = ANSWER_CACHE_THRESHOLD,
+                 entities_fn: Callable[[str], frozenset] = query_numbers):
+        self.embedder = embedder
+        self.entities_fn = entities_fn
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # znormalizowane pytanie -> (wynik, wektor, encje, czas zapisu)
+        self._version = None
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0,
+                       "stale_writes": 0}
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _check_version(self):
+        version = self.version_fn()
+        if version != self._version:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._version = version
+        return version
+
+    def _purge_expired(self, now: float):
+        expired = [key for key, (_, _, _, stored_at) in self._entries.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        self._stats["evictions"] += len(expired)
+
+    def get(self, query: str) -> tuple[Optional[dict], object]:
+        """(wynik albo None, wersja indeksu z chwili sprawdzenia - do przekazania w put)."""
+        key = normalize_query(query)
+        with self._lock:
+            version = self._check_version()
+            self._purge_expired(time.monotonic())
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return self._entries[key][0], version
+            if not self._entries:
+                self._stats["misses"] += 1
+                return None, version
+            candidates = list(self._entries.items())
+
+        # Encje i embedding pytania liczymy poza blokadą; "Galaxy S24" nie może dostać odpowiedzi o S25
+        entities = self.entities_fn(query)
+        matching = [(k, vector) for k, (_, vector, entry_entities, _) in candidates if entry_entities == entities]
+        if not matching:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, version
+        keys = [k for k, _ in matching]
+        scores = np.stack([vector for _, vector in matching]) @ self._embed(key)
+        best = int(np.argmax(scores))
+        with self._lock:
+            if scores[best] >= self.similarity_threshold and keys[best] in self._entries:
+                self._entries.move_to_end(keys[best])
+                self._stats["semantic_hits"] += 1
+                return self._entries[keys[best]][0], version
+            self._stats["misses"] += 1
+            return None, version
+
+    def put(self, query: str, result: dict, version):
+        key = normalize_query(query)
+        vector = self._embed(key)
+        entities = self.entities_fn(query)
+        with self._lock:
+            if self._check_version() != version:
+                # Odpowiedź policzona na wersji, która w międzyczasie została zastąpiona
+                self._stats["stale_writes"] += 1
+                return
+            self._entries[key] = (result, vector, entities, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            lookups = hits + self._stats["misses"]
+            return {**self._stats, "hits": hits, "hit_rate": hits / lookups if lookups else 0.0, "size": len(self._entries)}
+
+
+class CachedQAChain:
+    """Łańcuch QA z cache odpowiedzi przed nim - wywoływany tak samo jak RetrievalQA: chain(query).
+
+    `version` to wersja indeksu, na której zbudowano `chain`; odpowiedzi zapisywane są pod nią.
+    """
+
+    def __init__(self, chain, cache: AnswerCache, version=None):
+        self.chain = chain
+        self.cache = cache
+        self.version = version
+
+    def __call__(self, query: str) -> dict:
+        metrics.inc("rag_queries_total", endpoint="chain")
+        with metrics.trace("query", question=query):
+            with metrics.span("answer_cache_lookup"):
+                result, version = self.cache.get(query)
+            if result is not None:
+                return {**result, "query": query}
+            result = self.chain(query)
+            self.cache.put(query, result, version if self.version is None else self.version)
+            return result
@@ -1,10 +1,6 @@
 import streamlit as st 
 from dotenv import load_dotenv
 import os
-from pathlib import Path
-from rag_pipeline import load_vectorstore, build_qa_chain
-from loader import load_documents
-from difflib import SequenceMatcher
 
 # Load HuggingFace token
 load_dotenv()
@@ -129,26 +125,28 @@ with col2:
 if "history" not in st.session_state:
     st.session_state.history = []
 
-if not Path("vectorstore/index.faiss").exists():
+# Ciężkie importy (langchain, sentence-transformers, fitz) dopiero po wyrenderowaniu strony
+from rag_pipeline import get_qa_chain, index_exists
+
+if not index_exists():
     with st.spinner("Tworzę bazę wiedzy..."):
-        docs = load_documents("data/docs/")
         from rag_pipeline import create_vectorstore
-        create_vectorstore(docs)
-
-db = load_vectorstore()
-qa_chain = build_qa_chain(db)
+        from loader import iter_documents
+        create_vectorstore(iter_documents("data/docs/"))
 
-def similarity(a, b):
-    return SequenceMatcher(None, a, b).ratio()
+# Embedder, indeks i łańcuch QA są budowane raz na proces i współdzielone między sesjami
+qa_chain = get_qa_chain()
 
 def ask_question(query):
     st.session_state.history.append({"role": "user", "content": query})
     result = qa_chain(query)
     answer = result["result"]
+    # Trafność liczona raz przy wyszukiwaniu (metadata["score"]) - sortujemy tylko przy zapisie do historii
+    sources = sorted(result.get("source_documents", []), key=lambda d: d.metadata.get("score", 0), reverse=True)
     st.session_state.history.append({
         "role": "bot",
         "content": answer,
-        "sources": result.get("source_documents", [])
+        "sources": sources
     })
 
 def handle_input():
@@ -166,12 +164,7 @@ for msg in st.session_state.history:
         sources = msg.get("sources", [])
         if sources:
             with st.expander("📄 Pokaż źródła użyte do odpowiedzi"):
-                sorted_docs = sorted(
-                    sources,
-                    key=lambda d: similarity(d.page_content, msg["content"]),
-                    reverse=True
-                )
-                for i, doc in enumerate(sorted_docs):
+                for i, doc in enumerate(sources):
                     filename = doc.metadata.get("filename", "Nieznany plik")
                     page = doc.metadata.get("page", None)
                     source_info = f"{filename}"
@@ -0,0 +1,179 @@
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import fitz  # noqa: F401 - import PyMuPDF poza pomiarem load_documents
+from langchain_community.embeddings import DeterministicFakeEmbedding, HuggingFaceEmbeddings
+
+from context_assembly import assemble_context
+from embedding_cache import CachedEmbeddings
+from loader import SUPPORTED_SUFFIXES, iter_documents, load_documents
+from rag_pipeline import (DEFAULT_INDEX_PARAMS, EMBEDDING_MODEL, INDEX_TYPE, LocalStubLLM, _get_splitter, build_qa_chain,
+                          create_vectorstore, load_vectorstore, use_embedder)
+
+# Pytania jak w ruchu produkcyjnym - do pomiaru wyszukiwania i pełnego RetrievalQA
+QUESTIONS = [
+    "Który telefon ma najwięcej pamięci RAM?",
+    "Jakie są różnice między Galaxy S25 Ultra a S24 FE?",
+    "Czy Galaxy Z Flip 6 obsługuje Dual SIM?",
+    "Jaką pojemność ma bateria Galaxy A56?",
+    "Jaki procesor ma Galaxy S24 Ultra?",
+    "Ile waży Galaxy Z Fold 6?",
+    "Jaka jest przekątna ekranu Galaxy S25 Edge?",
+    "Czy Galaxy XCover 6 Pro jest wodoodporny?",
+]
+K_VALUES = [1, 4, 10]
+
+
+def _latency_stats(samples_ms: list[float]) -> dict:
+    ordered = sorted(samples_ms)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 3)
+
+    return {"p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "mean_ms": round(statistics.fmean(ordered), 3)}
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else float("inf")
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def scaled_corpus(docs_dir: Path, scale: int, work_dir: Path) -> Path:
+    """Syntetyczny katalog: każdy plik z docs_dir skopiowany `scale` razy pod inną nazwą."""
+    if scale == 1:
+        return docs_dir
+    target = work_dir / f"docs_x{scale}"
+    target.mkdir(parents=True, exist_ok=True)
+    for file in docs_dir.glob("*"):
+        if file.suffix.lower() in SUPPORTED_SUFFIXES:
+            for copy in range(scale):
+                shutil.copyfile(file, target / f"kopia{copy:03d}-{file.name}")
+    return target
+
+
+def run_corpus(docs_dir: Path, embedder, work_dir: Path, queries: int, index_type: str = INDEX_TYPE) -> dict:
+    """Pomiar na ścieżkach produkcyjnych: create_vectorstore, load_vectorstore (mmap) i assemble_context."""
+    result = {}
+
+    docs, seconds = _timed(load_documents, str(docs_dir))
+    result["load_documents"] = {"pages": len(docs), "seconds": round(seconds, 3), "pages_per_s": _rate(len(docs), seconds)}
+    streamed, seconds = _timed(lambda: sum(1 for _ in iter_documents(str(docs_dir))))
+    result["iter_documents"] = {"pages": streamed, "seconds": round(seconds, 3), "pages_per_s": _rate(streamed, seconds)}
+
+    chunks, seconds = _timed(_get_splitter().split_documents, docs)
+    result["split"] = {"chunks": len(chunks), "seconds": round(seconds, 3), "chunks_per_s": _rate(len(chunks), seconds)}
+
+    # Ekstrakcja, split, embedding partiami i zapis wersji - jak build_vectorstore.py --rebuild
+    persist_dir = work_dir / f"index_{docs_dir.name}"
+    hits, misses = getattr(embedder, "hits", 0), getattr(embedder, "misses", 0)
+    vectordb, seconds = _timed(create_vectorstore, iter_documents(str(docs_dir)), persist_path=str(persist_dir),
+                               index_type=index_type)
+    result["create_vectorstore"] = {
+        "vectors": vectordb.index.ntotal,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": _rate(vectordb.index.ntotal, seconds),
+        "size_bytes": _dir_size(persist_dir),
+    }
+    if isinstance(embedder, CachedEmbeddings):
+        result["create_vectorstore"]["cache_hits"] = embedder.hits - hits
+        result["create_vectorstore"]["cache_misses"] = embedder.misses - misses
+
+    vectordb, seconds = _timed(load_vectorstore, str(persist_dir))
+    result["load_vectorstore"] = {"index": type(vectordb.index).__name__, "seconds": round(seconds, 3)}
+
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(queries)]
+    result["retrieval"] = {}
+    for k in K_VALUES:
+        samples = [_timed(assemble_context, vectordb, q, max_documents=k)[1] * 1000 for q in questions]
+        result["retrieval"][f"k={k}"] = _latency_stats(samples)
+
+    # Pełny RetrievalQA z deterministycznym lokalnym LLM zamiast HFInferenceLLM
+    chain = build_qa_chain(vectordb, llm=LocalStubLLM())
+    samples = [_timed(chain.invoke, {"query": q})[1] * 1000 for q in questions]
+    result["qa_end_to_end"] = _latency_stats(samples)
+    return result
+
+
+def compare(current: dict, baseline: dict, prefix: str = "") -> list[str]:
+    """Lista różnic liczbowych względem poprzedniego wyniku (procentowo)."""
+    lines = []
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict) and isinstance(old, dict):
+            lines.extend(compare(value, old, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            lines.append(f"{prefix}{key}: {old} -> {value} ({(value - old) / old * 100:+.1f}%)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark pipeline'u RAG (ładowanie, split, embedding, indeks, wyszukiwanie, QA).")
+    parser.add_argument("--docs", default="data/docs/")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="mnożniki korpusu, np. 1 10 100")
+    parser.add_argument("--queries", type=int, default=200, help="liczba zapytań na pomiar opóźnienia")
+    parser.add_argument("--embedder", choices=["model", "fake"], default="model",
+                        help="fake - deterministyczne wektory bez pobierania modelu")
+    parser.add_argument("--index-type", choices=list(DEFAULT_INDEX_PARAMS), default=INDEX_TYPE,
+                        help="indeks do wyszukiwania budowany przez create_vectorstore")
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help="embedding bez cache (domyślnie cache w katalogu tymczasowym, nie w cache/embeddings/)")
+    parser.add_argument("--output", help="zapisz wynik JSON do pliku")
+    parser.add_argument("--baseline", help="porównaj z wcześniejszym wynikiem JSON")
+    args = parser.parse_args()
+
+    if args.embedder == "fake":
+        embedder = DeterministicFakeEmbedding(size=384)
+    else:
+        embedder = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "embedder": EMBEDDING_MODEL if args.embedder == "model" else "fake",
+            "embedding_cache": not args.no_embedding_cache,
+            "index_type": args.index_type,
+            "queries": args.queries,
+        },
+        "corpora": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        if not args.no_embedding_cache:
+            # Cache tylko na czas przebiegu - kopie plików w x10/x100 trafiają w niego jak ponowna synchronizacja
+            embedder = CachedEmbeddings(embedder, report["meta"]["embedder"], cache_dir=work_dir / "embeddings")
+        use_embedder(embedder)
+        for scale in args.scales:
+            docs_dir = scaled_corpus(Path(args.docs), scale, work_dir)
+            report["corpora"][f"x{scale}"] = run_corpus(docs_dir, embedder, work_dir, args.queries, args.index_type)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        print("\nZmiana względem", args.baseline)
+        for line in compare(report["corpora"], baseline.get("corpora", {})):
+            print(" ", line)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
-from loader import load_documents
-from rag_pipeline import create_vectorstore
+import argparse
+from collections import Counter
+
+from loader import iter_documents
+from rag_pipeline import create_vectorstore, index_exists, load_manifest, sync_vectorstore
+
+DOCS_DIR = "data/docs/"
 
 if __name__ == "__main__":
-    docs = load_documents("data/docs/")
-    print(f"Liczba załadowanych dokumentów: {len(docs)}")
-    if docs:
-        create_vectorstore(docs)
-        print("Wektorowa baza została utworzona i zapisana w folderze 'vectorstore'.")
+    parser = argparse.ArgumentParser(description="Buduje lub aktualizuje bazę wektorową z plików w data/docs/.")
+    parser.add_argument("--rebuild", action="store_true", help="zbuduj indeks od zera zamiast synchronizacji przyrostowej")
+    args = parser.parse_args()
+
+    if index_exists() and not args.rebuild:
+        # Przeliczane są tylko pliki nowe, zmienione i usunięte z folderu
+        statuses = Counter(sync_vectorstore(DOCS_DIR).values())
+        print("Synchronizacja z folderem:", ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())) or "brak plików")
+        files = load_manifest()["files"]
+        print(f"Plików w indeksie: {len(files)}, stron: {sum(entry['pages'] for entry in files.values())}")
     else:
-        print("Brak dokumentów do przetworzenia w folderze data/docs/")
\ No newline at end of file
+        # Ekstrakcja PDF-ów idzie równolegle na wszystkich rdzeniach, embedding partiami w trakcie
+        vectordb = create_vectorstore(iter_documents(DOCS_DIR))
+        if vectordb is not None:
+            files = load_manifest()["files"]
+            pages = sum(entry["pages"] for entry in files.values())
+            print(f"Liczba załadowanych dokumentów: {pages} (plików: {len(files)})")
+            print("Wektorowa baza została utworzona i zapisana w folderze 'vectorstore'.")
+        else:
+            print(f"Brak dokumentów do przetworzenia w folderze {DOCS_DIR}")
@@ -0,0 +1,155 @@
+import os
+import math
+from typing import Any, List, Optional
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+import metrics
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 800))  # tokeny kontekstu w prompcie
+RETRIEVER_FETCH_K = int(os.getenv("RETRIEVER_FETCH_K", 12))  # kandydaci z FAISS przed składaniem
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))  # 1 - sama trafność, 0 - sama różnorodność
+DUPLICATE_THRESHOLD = 0.95  # cosinus między fragmentami, od którego uznajemy je za prawie duplikaty
+CHARS_PER_TOKEN = 3.5  # przybliżenie dla polskiego tekstu i tokenizera Llamy
+MIN_OVERLAP = 20  # krótsza wspólna końcówka/początek to przypadek, nie zakładka splittera
+MAX_OVERLAP = 100  # chunk_overlap z _get_splitter (rag_pipeline)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class Candidate:
+    """Fragment z wyszukiwania: dokument, jego znormalizowany wektor i trafność (cosinus do pytania)."""
+
+    def __init__(self, doc: Document, vector: np.ndarray, score: float):
+        self.doc = doc
+        self.vector = vector
+        self.score = score
+
+
+def _candidate_vectors(vectordb, positions: List[int], docs: List[Document]) -> np.ndarray:
+    # IVF-PQ trzyma tylko stratne kody - reconstruct() dałby przybliżenia, przez które różne fragmenty
+    # wyglądałyby na duplikaty. Dokładne wektory daje płaski indeks wersji (load_vectorstore: exact_index).
+    exact_index = getattr(vectordb, "exact_index", None)
+    if exact_index is None and faiss.try_extract_index_ivf(vectordb.index) is not None:
+        # IVF bez płaskiego obok (indeks złożony ręcznie) - liczymy z treści
+        return np.asarray(vectordb.embedding_function.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    return np.vstack([(exact_index or vectordb.index).reconstruct(i) for i in positions])
+
+
+def retrieve_candidates(vectordb, query: str, fetch_k: int = RETRIEVER_FETCH_K) -> List[Candidate]:
+    """Najbliższe fragmenty z FAISS razem z dokładnymi wektorami - trafność liczona raz, tutaj."""
+    query_vector = np.asarray(vectordb.embedding_function.embed_query(query), dtype=np.float32)
+    with metrics.span("faiss_search"):
+        _, found = vectordb.index.search(query_vector[None, :], fetch_k)
+    positions, docs = [], []
+    for i in found[0]:
+        doc = vectordb.docstore.search(vectordb.index_to_docstore_id[int(i)]) if i != -1 else None
+        if isinstance(doc, Document):
+            positions.append(int(i))
+            docs.append(doc)
+    if not docs:
+        return []
+    vectors = _normalize(_candidate_vectors(vectordb, positions, docs))
+    scores = vectors @ _normalize(query_vector)
+    return [Candidate(doc, vector, float(score)) for doc, vector, score in zip(docs, vectors, scores)]
+
+
+def _overlap(left: str, right: str) -> int:
+    # Długość zakładki: koniec `left` powtarza się na początku `right` (chunk_overlap splittera)
+    for size in range(min(len(left), len(right), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_adjacent(candidates: List[Candidate]) -> List[Candidate]:
+    """Skleja sąsiednie fragmenty tej samej strony, których zakładka się pokrywa, w jeden dłuższy."""
+    merged = list(candidates)
+    changed = True
+    while changed:
+        changed = False
+        for a in merged:
+            for b in merged:
+                if a is b or a.doc.metadata.get("filename") != b.doc.metadata.get("filename") \
+                        or a.doc.metadata.get("page") != b.doc.metadata.get("page"):
+                    continue
+                size = _overlap(a.doc.page_content, b.doc.page_content)
+                if not size:
+                    continue
+                best = a if a.score >= b.score else b
+                doc = Document(page_content=a.doc.page_content + b.doc.page_content[size:], metadata=best.doc.metadata)
+                joined = Candidate(doc, _normalize(a.vector + b.vector), max(a.score, b.score))
+                merged = [c for c in merged if c is not a and c is not b] + [joined]
+                changed = True
+                break
+            if changed:
+                break
+    return sorted(merged, key=lambda c: c.score, reverse=True)
+
+
+def select_context(candidates: List[Candidate], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                   max_documents: Optional[int] = None, lambda_mult: float = MMR_LAMBDA) -> List[Document]:
+    """MMR w budżecie tokenów: trafne, ale różne fragmenty; prawie duplikaty odpadają.
+
+    Zwraca kopie dokumentów z trafnością w metadata["score"] (do sortowania źródeł w UI).
+    Najlepszy fragment trafia zawsze, w razie potrzeby przycięty do budżetu.
+    """
+    remaining = list(candidates)
+    selected = []
+    docs = []
+    budget = token_budget
+    while remaining and budget > 0 and (max_documents is None or len(selected) < max_documents):
+        if selected:
+            chosen = np.vstack([c.vector for c in selected])
+            redundancy = [float(np.max(chosen @ c.vector)) for c in remaining]
+        else:
+            redundancy = [0.0] * len(remaining)
+        best = max(range(len(remaining)), key=lambda i: lambda_mult * remaining[i].score - (1 - lambda_mult) * redundancy[i])
+        candidate = remaining.pop(best)
+        if redundancy[best] >= DUPLICATE_THRESHOLD:
+            continue
+        tokens = estimate_tokens(candidate.doc.page_content)
+        text = candidate.doc.page_content
+        if tokens > budget:
+            if selected:
+                continue
+            text = text[:int(budget * CHARS_PER_TOKEN)]
+            tokens = budget
+        budget -= tokens
+        selected.append(candidate)
+        docs.append(Document(page_content=text, metadata={**candidate.doc.metadata, "score": round(candidate.score, 4)}))
+    return docs
+
+
+def assemble_context(vectordb, query: str, max_documents: Optional[int] = None,
+                     token_budget: int = CONTEXT_TOKEN_BUDGET, fetch_k: int = RETRIEVER_FETCH_K,
+                     lambda_mult: float = MMR_LAMBDA) -> List[Document]:
+    """Wyszukiwanie + składanie kontekstu: sklejenie zakładek, odrzucenie duplikatów, MMR w budżecie tokenów."""
+    fetch_k = max(fetch_k, 3 * (max_documents or 0))
+    with metrics.span("retrieval"):
+        candidates = retrieve_candidates(vectordb, query, fetch_k)
+    with metrics.span("context_assembly"):
+        return select_context(merge_adjacent(candidates), token_budget, max_documents, lambda_mult)
+
+
+class AssembledContextRetriever(BaseRetriever):
+    """Retriever dla RetrievalQA: zamiast k surowych chunków zwraca kontekst z assemble_context."""
+    vectorstore: Any
+    k: Optional[int] = None
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    fetch_k: int = RETRIEVER_FETCH_K
+    lambda_mult: float = MMR_LAMBDA
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return assemble_context(self.vectorstore, query, self.k, self.token_budget, self.fetch_k, self.lambda_mult)
@@ -0,0 +1,252 @@
+import os
+import json
+import hashlib
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+try:
+    import fcntl
+except ImportError:  # Windows - zostaje tylko blokada w obrębie procesu
+    fcntl = None
+
+import metrics
+
+EMBEDDING_CACHE_DIR = "cache/embeddings/"
+MAX_CACHE_ENTRIES = 200_000
+EMBED_MISS_BATCH_SIZE = 512
+
+
+class CachedEmbeddings(Embeddings):
+    """Dyskowy cache embeddingów chunków, adresowany treścią.
+
+    Klucz to hash (nazwa modelu, tekst chunka). Wektory leżą w jednym pliku float32
+    (`vectors.f32`, czytanym przez np.memmap). `index.json` to migawka mapy klucz -> [wiersz,
+    ostatnie użycie], a `journal.log` dopisuje zmiany od migawki - zapis jest proporcjonalny
+    do partii, nie do rozmiaru cache. Migawka powstaje na nowo, gdy dziennik urośnie.
+    Do modelu trafiają tylko braki, dużymi partiami. Po przekroczeniu `max_entries`
+    najdawniej używane wpisy są usuwane, a plik kompaktowany.
+    Cache współdzielą procesy (Streamlit, uvicorn): każdy odczyt i zapis stanu idzie pod flock
+    i zaczyna się od doczytania zmian innych procesów. Zapytania (embed_query) idą bez cache.
+    """
+
+    def __init__(self, embedder: Embeddings, model_name: str, cache_dir=EMBEDDING_CACHE_DIR,
+                 max_entries: int = MAX_CACHE_ENTRIES, batch_size: int = EMBED_MISS_BATCH_SIZE):
+        self.embedder = embedder
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        # Osobny katalog na model - różne modele mają różny wymiar wektorów
+        self.path = Path(cache_dir) / re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dim = None
+        self._tick = 0
+        self._entries = {}  # klucz -> [wiersz, ostatnie użycie]
+        self._vectors = None
+        self._snapshot_stamp = None  # (inode, mtime_ns, rozmiar) wczytanej migawki index.json
+        self._vectors_stamp = None  # (inode, rozmiar) zmapowanego vectors.f32
+        self._journal_offset = 0
+        self._journal_lines = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b(f"{self.model_name}\x00{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    @property
+    def _vectors_file(self) -> Path:
+        return self.path / "vectors.f32"
+
+    @property
+    def _index_file(self) -> Path:
+        return self.path / "index.json"
+
+    @property
+    def _journal_file(self) -> Path:
+        return self.path / "journal.log"
+
+    @staticmethod
+    def _stamp(path: Path, *fields):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return tuple(getattr(stat, field) for field in fields)
+
+    @contextmanager
+    def _locked(self):
+        # Blokada w procesie + flock między procesami; stan z dysku doczytywany zawsze pod blokadą
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path / ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._sync()
+            yield
+
+    def _sync(self):
+        stamp = self._stamp(self._index_file, "st_ino", "st_mtime_ns", "st_size")
+        if stamp != self._snapshot_stamp:
+            self._snapshot_stamp = stamp
+            self._entries, self._tick, self._journal_offset, self._journal_lines = {}, 0, 0, 0
+            if stamp is not None:
+                with open(self._index_file, encoding="utf-8") as f:
+                    index = json.load(f)
+                self._dim = index["dim"]
+                self._tick = index["tick"]
+                self._entries = index["entries"]
+        self._replay_journal()
+        vectors_stamp = self._stamp(self._vectors_file, "st_ino", "st_size")
+        if vectors_stamp != self._vectors_stamp:
+            self._open_vectors()
+
+    def _replay_journal(self):
+        # Wiersze dziennika: "klucz wiersz użycie" (nowy wpis albo odświeżone użycie)
+        try:
+            with open(self._journal_file, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < self._journal_offset:  # dziennik wyczyszczony bez nowej migawki
+                    self._snapshot_stamp = None
+                    self._sync()
+                    return
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # Urwany ostatni wiersz (przerwany zapis) - obcinamy, żeby następny dopisek był poprawny
+            with open(self._journal_file, "r+b") as f:
+                f.truncate(self._journal_offset + end)
+        for line in data[:end].decode("utf-8").splitlines():
+            key, row, used = line.split()
+            self._entries[key] = [int(row), int(used)]
+            self._tick = max(self._tick, int(used))
+            self._journal_lines += 1
+        self._journal_offset += end
+        if self._dim is None and self._entries and self._vectors_file.exists():
+            self._dim = self._read_dim()
+
+    def _read_dim(self) -> int:
+        with open(self.path / "dim", encoding="utf-8") as f:
+            return int(f.read())
+
+    def _open_vectors(self):
+        self._vectors = None
+        self._vectors_stamp = self._stamp(self._vectors_file, "st_ino", "st_size")
+        if self._dim is None or self._vectors_stamp is None:
+            return
+        rows = self._vectors_stamp[1] // (4 * self._dim)
+        if rows:
+            self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode="r+", shape=(rows, self._dim))
+
+    def _capacity(self) -> int:
+        return 0 if self._vectors is None else self._vectors.shape[0]
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity():
+            return
+        # Plik rośnie skokowo (x2), żeby nie przepisywać go przy każdej partii
+        new_rows = max(rows, 2 * self._capacity(), 1024)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_file, "ab") as f:
+            f.truncate(new_rows * self._dim * 4)
+        self._open_vectors()
+
+    def _store(self, keys: List[str], vectors: List[List[float]]):
+        array = np.asarray(vectors, dtype=np.float32)
+        if self._dim is None:
+            self._dim = array.shape[1]
+            (self.path / "dim").write_text(str(self._dim), encoding="utf-8")
+        # Wiersze przydzielamy ze stanu doczytanego pod blokadą, nigdy z nieaktualnego
+        start = len(self._entries)
+        self._ensure_capacity(start + len(keys))
+        self._vectors[start:start + len(keys)] = array
+        self._vectors.flush()
+        for offset, key in enumerate(keys):
+            self._entries[key] = [start + offset, self._tick]
+
+    def _append_journal(self, keys: List[str]):
+        lines = "".join(f"{key} {self._entries[key][0]} {self._entries[key][1]}\n" for key in keys)
+        with open(self._journal_file, "ab") as f:
+            f.write(lines.encode("utf-8"))
+            self._journal_offset = f.tell()
+        self._journal_lines += len(keys)
+
+    def _evict(self) -> bool:
+        if len(self._entries) <= self.max_entries:
+            return False
+        # Zostawiamy 90% limitu najświeższych wpisów i kompaktujemy plik
+        keep = sorted(self._entries.items(), key=lambda item: item[1][1], reverse=True)[:int(self.max_entries * 0.9)]
+        rows = np.array([row for _, (row, _) in keep], dtype=np.int64)
+        kept_vectors = np.array(self._vectors[rows]) if len(rows) else np.empty((0, self._dim), dtype=np.float32)
+        self._vectors.flush()
+        self._vectors = None
+        tmp_file = self._vectors_file.with_suffix(".f32.tmp")
+        kept_vectors.tofile(tmp_file)
+        os.replace(tmp_file, self._vectors_file)
+        self._entries = {key: [row, used] for row, (key, (_, used)) in enumerate(keep)}
+        self._open_vectors()
+        return True
+
+    def _write_snapshot(self):
+        # Najpierw czyścimy dziennik, potem podmieniamy migawkę: przerwanie w środku gubi najwyżej
+        # świeże wpisy (chybienia), ale nigdy nie odtwarza starego dziennika na nowej migawce
+        tmp_file = self._index_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self._dim, "tick": self._tick, "entries": self._entries}, f)
+        open(self._journal_file, "wb").close()
+        os.replace(tmp_file, self._index_file)
+        self._snapshot_stamp = self._stamp(self._index_file, "st_ino", "st_mtime_ns", "st_size")
+        self._journal_offset = 0
+        self._journal_lines = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._locked():
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._entries and key not in missing:
+                    missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        metrics.inc("rag_embedding_cache_total", len(missing), result="miss")
+        metrics.inc("rag_embedding_cache_total", len(texts) - len(missing), result="hit")
+
+        # Model liczy poza blokadą - to najdłuższy etap
+        missing_keys = list(missing)
+        computed = []
+        with metrics.span("embed_documents"):
+            for i in range(0, len(missing_keys), self.batch_size):
+                batch = [missing[key] for key in missing_keys[i:i + self.batch_size]]
+                computed.extend(self.embedder.embed_documents(batch))
+
+        with self._locked():
+            self._tick += 1
+            fresh = [(k, v) for k, v in zip(missing_keys, computed) if k not in self._entries]
+            # Trafienie mogło w międzyczasie wypaść z cache przy eviction w innym procesie
+            texts_by_key = dict(zip(keys, texts))
+            lost = [k for k in dict.fromkeys(keys) if k not in self._entries and k not in missing]
+            if lost:
+                fresh.extend(zip(lost, self.embedder.embed_documents([texts_by_key[k] for k in lost])))
+            if fresh:
+                self._store([k for k, _ in fresh], [v for _, v in fresh])
+            result = []
+            for key in keys:
+                entry = self._entries[key]
+                entry[1] = self._tick
+                result.append(self._vectors[entry[0]].tolist())
+            if self._evict() or self._journal_lines + len(keys) > max(len(self._entries), 10_000):
+                self._write_snapshot()
+            else:
+                self._append_journal(list(dict.fromkeys(keys)))
+        return result
+
+    def embed_query(self, text: str) -> List[float]:
+        with metrics.span("embed_query"):
+            return self.embedder.embed_query(text)
@@ -0,0 +1,146 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lokalny zamiennik endpointu /v1/chat/completions (format OpenAI/TGI) do testów HFInferenceLLM bez sieci:
+#   python fake_inference_server.py --latency 0.5 --fail-rate 0.2
+#   HF_INFERENCE_BASE_URL=http://127.0.0.1:8090 uvicorn fastapi_app:app
+# GET /stats zwraca liczniki zapytań (np. do sprawdzenia łączenia identycznych promptów).
+
+
+class FakeInference:
+    def __init__(self, latency: float, token_delay: float, fail_rate: float, fail_status: int, retry_after: float):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0, "active": 0, "max_active": 0}
+
+    def enter(self) -> bool:
+        """Rejestruje zapytanie; False - zapytanie ma zakończyć się symulowanym błędem."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if random.random() < self.fail_rate:
+                self.stats["failures"] += 1
+                return False
+            self.stats["active"] += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.stats["active"] -= 1
+
+    @staticmethod
+    def answer(messages: list) -> list[str]:
+        prompt = messages[-1]["content"] if messages else ""
+        question = prompt.rsplit("Question:", 1)[-1].split("\n", 1)[0].strip()
+        words = f"Odpowiedź testowa ({len(prompt)} znaków promptu) na pytanie: {question}".split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+
+def make_handler(fake: FakeInference):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive - klient może utrzymywać połączenia w puli
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with fake._lock:
+                    self._send_json(200, dict(fake.stats))
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": "not found"})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not fake.enter():
+                headers = {"Retry-After": str(fake.retry_after)} if fake.retry_after else {}
+                self._send_json(fake.fail_status, {"error": "symulowany błąd"}, headers)
+                return
+            try:
+                time.sleep(fake.latency)
+                tokens = fake.answer(body.get("messages", []))
+                model = body.get("model", "fake")
+                if not body.get("stream"):
+                    self._send_json(200, {
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(tokens)}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in tokens:
+                    chunk = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}]}
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    time.sleep(fake.token_delay)
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # klient przerwał strumień
+            finally:
+                fake.leave()
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8090, latency: float = 0.2, token_delay: float = 0.01,
+          fail_rate: float = 0.0, fail_status: int = 503, retry_after: float = 0.0) -> ThreadingHTTPServer:
+    """Uruchamia serwer w wątku w tle (do skryptów testowych); zatrzymanie: server.shutdown()."""
+    fake = FakeInference(latency, token_delay, fail_rate, fail_status, retry_after)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer udający endpoint chat completions (testy LLM bez sieci).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.2, help="sekundy przed odpowiedzią / pierwszym tokenem")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="sekundy między tokenami strumienia")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="odsetek zapytań kończonych błędem")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=0.0, help="nagłówek Retry-After przy błędzie")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.token_delay, args.fail_rate, args.fail_status, args.retry_after)
+    print(f"Fake inference server: http://{args.host}:{args.port}/v1/chat/completions (Ctrl+C - koniec)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,29 @@
 # fastapi_app.py
 import os
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import json
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from rag_pipeline import create_vectorstore
-from loader import load_documents
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from rag_pipeline import upsert_file, delete_document, load_manifest, astream_answer, get_answer_cache, RETRIEVER_K
+from loader import SUPPORTED_SUFFIXES
+from ingest_jobs import IngestQueue
+import metrics
 from pathlib import Path
 
-app = FastAPI()
+ingest_queue = IngestQueue()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ingest_queue.start()
+    yield
+    await ingest_queue.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Pozwól na CORS (zwłaszcza do testów lokalnych)
 app.add_middleware(
@@ -18,16 +35,119 @@ app.add_middleware(
 
 UPLOAD_DIR = Path("data/docs/")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+MAX_K = 20  # górny limit fragmentów kontekstu na pytanie w /ask
 
-@app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith((".pdf", ".md")):
+
+def _target_path(filename: str) -> Path:
+    # Tylko sama nazwa pliku - bez wychodzenia poza UPLOAD_DIR
+    name = Path(filename).name
+    if not name.lower().endswith(SUPPORTED_SUFFIXES):
         raise HTTPException(status_code=400, detail="Tylko pliki PDF i MD są wspierane.")
-    save_path = UPLOAD_DIR / file.filename
+    return UPLOAD_DIR / name
+
+
+def _queue_full():
+    return HTTPException(status_code=503, detail="Kolejka indeksowania jest pełna, spróbuj ponownie później.")
+
+
+async def _save_upload(file: UploadFile, save_path: Path) -> Path:
+    # Plik tymczasowy obok docelowego (.part - pomijany przez sync); na miejsce trafia dopiero w zadaniu
+    if ingest_queue.full():
+        raise _queue_full()
+    tmp_path = save_path.with_name(f"{save_path.name}.{uuid.uuid4().hex}.part")
     content = await file.read()
-    with open(save_path, "wb") as f:
-        f.write(content)
-    # Przebuduj vectorstore po zapisie nowego pliku
-    docs = load_documents(str(UPLOAD_DIR))
-    create_vectorstore(docs)
-    return {"message": f"Plik '{file.filename}' przesłany i vectorstore przebudowany."}
\ No newline at end of file
+    await asyncio.to_thread(tmp_path.write_bytes, content)
+    return tmp_path
+
+
+def _install_upload(tmp_path: Path, save_path: Path, progress=None) -> str:
+    # Zadania idą po kolei, więc dwa uploady o tej samej nazwie są podmieniane i indeksowane w kolejności
+    os.replace(tmp_path, save_path)
+    return upsert_file(save_path, progress=progress)
+
+
+def _submit(action: str, filename: str, func, *args, tmp_path: Path = None) -> dict:
+    try:
+        job = ingest_queue.submit(action, filename, func, *args)
+    except asyncio.QueueFull:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        raise _queue_full()
+    return {"job_id": job["id"], "status": job["status"]}
+
+
+def _remove_file(save_path: Path, progress=None) -> bool:
+    removed = delete_document(save_path.name, progress=progress)
+    save_path.unlink(missing_ok=True)
+    return removed
+
+
+@app.post("/upload/", status_code=202)
+async def upload_file(file: UploadFile = File(...)):
+    save_path = _target_path(file.filename)
+    tmp_path = await _save_upload(file, save_path)
+    # Podmiana pliku i indeksowanie w tle - postęp pod /jobs/{job_id}
+    return {"message": f"Plik '{save_path.name}' przesłany, indeksowanie w kolejce.",
+            **_submit("upsert", save_path.name, _install_upload, tmp_path, save_path, tmp_path=tmp_path)}
+
+
+@app.put("/documents/{filename}", status_code=202)
+async def replace_file(filename: str, file: UploadFile = File(...)):
+    save_path = _target_path(filename)
+    if not save_path.exists():
+        raise HTTPException(status_code=404, detail=f"Plik '{save_path.name}' nie istnieje.")
+    tmp_path = await _save_upload(file, save_path)
+    return {"message": f"Plik '{save_path.name}' podmieniony, indeksowanie w kolejce.",
+            **_submit("replace", save_path.name, _install_upload, tmp_path, save_path, tmp_path=tmp_path)}
+
+
+@app.delete("/documents/{filename}", status_code=202)
+async def delete_file(filename: str):
+    save_path = _target_path(filename)
+    # Przy starym układzie indeksu load_manifest wczytuje cały FAISS - poza pętlą zdarzeń
+    if not save_path.exists() and save_path.name not in (await asyncio.to_thread(load_manifest))["files"]:
+        raise HTTPException(status_code=404, detail=f"Plik '{save_path.name}' nie istnieje.")
+    return {"message": f"Usuwanie pliku '{save_path.name}' w kolejce.",
+            **_submit("delete", save_path.name, _remove_file, save_path)}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Nie ma takiego zadania.")
+    return job
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/ask")
+async def ask(question: str, k: int = Query(RETRIEVER_K, ge=1, le=MAX_K)):
+    """Strumień SSE: `sources` (filename/page), kolejne `token`, na końcu `done`."""
+    if not question.strip():
+        raise HTTPException(status_code=400, detail="Pytanie nie może być puste.")
+
+    async def events():
+        try:
+            async for event, data in astream_answer(question, k=k):
+                yield _sse(event, data)
+        except Exception as exc:
+            yield _sse("error", {"detail": str(exc)})
+            return
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    cache = await asyncio.to_thread(get_answer_cache)
+    return cache.stats()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Format tekstowy Prometheusa: histogram rag_stage_seconds{stage=...}, liczniki i gauge
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,93 @@
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from rag_pipeline import DEFAULT_INDEX_PARAMS, build_index, current_index_dir, get_embedder
+
+# Konfiguracje porównywane domyślnie: (typ, parametry)
+CONFIGS = [
+    ("flat", {}),
+    ("hnsw", {"efSearch": 16}),
+    ("hnsw", {"efSearch": 64}),
+    ("hnsw", {"efSearch": 128}),
+    ("ivfpq", {"nprobe": 1}),
+    ("ivfpq", {"nprobe": 8}),
+    ("ivfpq", {"nprobe": 32}),
+]
+
+
+def _queries(vectors, args):
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        embedder = get_embedder()
+        return np.asarray([embedder.embed_query(q) for q in questions], dtype=np.float32)
+    # Bez pliku z pytaniami: losowe chunki z indeksu z lekkim szumem
+    rng = np.random.default_rng(args.seed)
+    sample = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    noise = rng.normal(scale=args.noise * float(vectors.std()), size=sample.shape)
+    return (sample + noise).astype(np.float32)
+
+
+def evaluate(index, queries, truth, k):
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return {
+        f"recall@{k}": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k względem indeksu płaskiego i opóźnienie zapytań dla typów indeksu FAISS.")
+    parser.add_argument("--persist-path", default="vectorstore/")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200, help="liczba zapytań, gdy brak --questions")
+    parser.add_argument("--questions", help="plik z pytaniami (jedno na linię) - embedowane modelem z rag_pipeline")
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="wynik jako JSON zamiast tabeli")
+    args = parser.parse_args()
+
+    flat = faiss.read_index(str(current_index_dir(args.persist_path) / "index.faiss"))
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    queries = _queries(vectors, args)
+    _, truth = flat.search(queries, args.k)
+
+    rows = []
+    for index_type, params in CONFIGS:
+        params = {**DEFAULT_INDEX_PARAMS[index_type], **params}
+        start = time.perf_counter()
+        # Typ i parametry faktycznie zbudowanego indeksu (małe katalogi przycinają IVF-PQ)
+        index, index_type, params = build_index(vectors, index_type, params)
+        build_s = time.perf_counter() - start
+        rows.append({
+            "index_type": index_type,
+            "params": params,
+            "build_s": round(build_s, 3),
+            "size_mb": round(faiss.serialize_index(index).nbytes / 1e6, 3),
+            **evaluate(index, queries, truth, args.k),
+        })
+
+    if args.json:
+        print(json.dumps({"ntotal": flat.ntotal, "dim": flat.d, "k": args.k, "results": rows}, indent=2))
+        return
+    print(f"Wektorów: {flat.ntotal}, wymiar: {flat.d}, zapytań: {len(queries)}, k={args.k}")
+    print(f"{'typ':<8}{'parametry':<52}{'recall':>8}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'MB':>9}")
+    for row in rows:
+        print(f"{row['index_type']:<8}{json.dumps(row['params']):<52}{row[f'recall@{args.k}']:>8}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['build_s']:>10}{row['size_mb']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+JOB_QUEUE_SIZE = 32
+MAX_FINISHED_JOBS = 1000
+
+
+class IngestQueue:
+    """Ograniczona kolejka zadań indeksowania obsługiwana przez jednego workera w tle.
+
+    Zadanie to zwykła funkcja (np. upsert_file) wykonywana w wątku, więc pętla zdarzeń
+    nie jest blokowana. Zapisy indeksu i tak są szeregowane, więc jeden worker wystarcza.
+    Zadanie dostaje callback `progress(stage)`, a stan jest dostępny przez get().
+    """
+
+    def __init__(self, maxsize: int = JOB_QUEUE_SIZE):
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._jobs = OrderedDict()
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def submit(self, action: str, filename: str, func: Callable, *args) -> dict:
+        """Dodaje zadanie; rzuca asyncio.QueueFull, gdy kolejka jest pełna."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "action": action,
+            "filename": filename,
+            "status": "queued",
+            "stage": None,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        self._queue.put_nowait((job, func, args))
+        self._jobs[job["id"]] = job
+        self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return dict(job, queue_position=self._position(job_id)) if job else None
+
+    def _position(self, job_id: str) -> Optional[int]:
+        queued = [job["id"] for job in self._jobs.values() if job["status"] == "queued"]
+        return queued.index(job_id) + 1 if job_id in queued else None
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    async def _run(self):
+        while True:
+            job, func, args = await self._queue.get()
+            job["status"] = "running"
+
+            def progress(stage, job=job):
+                job["stage"] = stage
+
+            try:
+                job["result"] = await asyncio.to_thread(func, *args, progress=progress)
+                job["status"] = "done"
+            except Exception as exc:
+                job["status"] = "failed"
+                job["error"] = str(exc)
+            finally:
+                job["finished_at"] = time.time()
+                self._queue.task_done()
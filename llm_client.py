@@ -0,0 +1,449 @@
+import os
+import json
+import time
+import random
+import queue
+import asyncio
+import hashlib
+import threading
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import deque
+from typing import Awaitable, Callable, Iterable, Iterator, AsyncIterator, Optional, TypeVar
+
+from huggingface_hub.errors import HfHubHTTPError, InferenceTimeoutError
+
+import metrics
+
+# Błędy sieci zależą od wersji huggingface_hub (httpx2 / httpx / requests)
+_TRANSPORT_ERRORS = []
+try:
+    from httpx2 import TransportError as _Httpx2TransportError
+    _TRANSPORT_ERRORS.append(_Httpx2TransportError)
+except ImportError:
+    pass
+try:
+    from httpx import TransportError as _HttpxTransportError
+    _TRANSPORT_ERRORS.append(_HttpxTransportError)
+except ImportError:
+    pass
+try:
+    from requests import ConnectionError as _RequestsConnectionError, Timeout as _RequestsTimeout
+    _TRANSPORT_ERRORS.extend([_RequestsConnectionError, _RequestsTimeout])
+except ImportError:
+    pass
+_TRANSPORT_ERRORS = tuple(_TRANSPORT_ERRORS)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))  # równoczesne zapytania do endpointu na proces
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))  # sekundy na jedną próbę
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 120))  # sekundy na całość: kolejka + próby + przerwy
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+_callers = weakref.WeakSet()
+_END = object()  # koniec strumienia z wątku roboczego
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Wywołanie LLM nie zmieściło się w terminie (czekanie w kolejce, próby i przerwy między nimi)."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, LLMDeadlineExceeded):
+        return False
+    if isinstance(error, HfHubHTTPError):
+        response = getattr(error, "response", None)
+        return response is not None and response.status_code in RETRY_STATUSES
+    return isinstance(error, (InferenceTimeoutError, *_TRANSPORT_ERRORS))
+
+
+def _retry_after(error: BaseException) -> float:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("Retry-After", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):  # Retry-After jako data HTTP - pomijamy
+        return 0.0
+
+
+def backoff_delay(attempt: int, retry_after: float = 0.0) -> float:
+    # "Full jitter": losowo z [0, min(max, base * 2^próba)], ale nie krócej niż każe serwer (429)
+    return max(retry_after, random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+
+def request_key(request: dict) -> str:
+    return hashlib.blake2b(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _AsyncWaiter:
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        # Zwolnienie slotu może przyjść z innego wątku
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _Slots:
+    """Semafor FIFO wspólny dla wątków (Streamlit, RetrievalQA) i pętli asyncio (FastAPI /ask).
+
+    Zwolniony slot przechodzi bezpośrednio na najdłużej czekającego, więc kolejka jest sprawiedliwa.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _enqueue(self, make_waiter):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return None
+            waiter = make_waiter()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _dequeue(self, waiter) -> bool:
+        # False - waiter już dostał slot (zwolnienie wyprzedziło timeout)
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return True
+            return False
+
+    def acquire(self, timeout: float) -> bool:
+        waiter = self._enqueue(threading.Event)
+        if waiter is None or waiter.wait(max(0.0, timeout)):
+            return True
+        return not self._dequeue(waiter)
+
+    async def aacquire(self, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(lambda: _AsyncWaiter(loop))
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, timeout))
+            return True
+        except asyncio.TimeoutError:
+            return not self._dequeue(waiter)
+        except asyncio.CancelledError:
+            if not self._dequeue(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            waiter = self._waiters.popleft()
+        waiter.set()
+
+
+class _SharedStream:
+    """Tokeny jednego strumienia z endpointu, odtwarzane każdemu subskrybentowi od początku."""
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def push(self, token: str):
+        self.tokens.append(token)
+        await self._notify()
+
+    async def close(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.done = True
+        await self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: i < len(self.tokens) or self.done)
+            while i < len(self.tokens):
+                yield self.tokens[i]
+                i += 1
+            if self.done and i >= len(self.tokens):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class ResilientCaller:
+    """Limit równoczesnych wywołań z kolejką, ponawianie z losowym backoffem, termin i łączenie duplikatów.
+
+    Identyczne zapytania w toku (ten sam klucz) są łączone: jedno wywołanie endpointu obsługuje
+    wszystkich czekających. Strumień jest ponawiany tylko przed pierwszym tokenem.
+    Próby synchroniczne idą w wątkach roboczych, żeby czekanie na nie kończyło się w terminie.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 deadline: float = LLM_DEADLINE, coalesce: bool = True):
+        self.slots = _Slots(max_concurrency)
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.coalesce = coalesce
+        self._lock = threading.Lock()
+        self._flights = {}  # klucz -> [Event, wynik, błąd] (wywołania synchroniczne)
+        self._tasks = {}  # (pętla, klucz) -> asyncio.Task
+        self._streams = {}  # (pętla, klucz) -> _SharedStream
+        # Każda trwająca próba trzyma slot, więc max_concurrency wątków wystarcza
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        _callers.add(self)
+
+    # ---- wspólne ----
+
+    def _retry_delay(self, error: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = backoff_delay(attempt, _retry_after(error))
+        if time.monotonic() + delay >= deadline:
+            return None
+        metrics.inc("rag_llm_retries_total")
+        return delay
+
+    def _timed_out(self, what: str):
+        metrics.inc("rag_llm_deadline_exceeded_total")
+        return LLMDeadlineExceeded(f"LLM: przekroczony termin {self.deadline:g} s ({what})")
+
+    def _acquire(self, deadline: float):
+        start = time.perf_counter()
+        if not self.slots.acquire(deadline - time.monotonic()):
+            raise self._timed_out("kolejka")
+        metrics.observe("llm_queue_wait", time.perf_counter() - start)
+
+    async def _aacquire(self, deadline: float):
+        start = time.perf_counter()
+        if not await self.slots.aacquire(deadline - time.monotonic()):
+            raise self._timed_out("kolejka")
+        metrics.observe("llm_queue_wait", time.perf_counter() - start)
+
+    # ---- wywołania synchroniczne ----
+
+    def _submit(self, fn: Callable[[], T]):
+        # Próba w wątku roboczym (z kontekstem metryk); slot zwalnia koniec próby, nie rezygnacja czekającego
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, fn)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def _with_retries(self, request: Callable[[], T]) -> T:
+        # Na próbę czekamy najwyżej do terminu - timeout klienta (LLM_TIMEOUT) może być dłuższy
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            future = self._submit(request)
+            try:
+                return future.result(max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                if future.done():  # TimeoutError z samej próby, nie z czekania
+                    delay = self._retry_delay(future.exception(), attempt, deadline)
+                    if delay is None:
+                        raise
+                else:
+                    raise self._timed_out("odpowiedź") from None
+            except Exception as error:
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def call(self, key: str, request: Callable[[], T]) -> T:
+        if not self.coalesce:
+            return self._with_retries(request)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = [threading.Event(), None, None]
+        if not leader:
+            metrics.inc("rag_llm_coalesced_total")
+            if not flight[0].wait(self.deadline):
+                raise self._timed_out("oczekiwanie na identyczne zapytanie")
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+        try:
+            flight[1] = self._with_retries(request)
+            return flight[1]
+        except BaseException as error:
+            flight[2] = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight[0].set()
+
+    @staticmethod
+    def _pump_tokens(request: Callable[[], Iterable[str]], tokens: queue.Queue, abandoned: threading.Event):
+        # Wątek roboczy czyta strumień i przekazuje tokeny; kończy, gdy czytelnik zrezygnował
+        try:
+            for token in request():
+                if abandoned.is_set():
+                    return
+                tokens.put((token, None))
+            tokens.put((_END, None))
+        except Exception as error:
+            tokens.put((_END, error))
+
+    def stream(self, request: Callable[[], Iterable[str]]) -> Iterator[str]:
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            tokens, abandoned = queue.Queue(), threading.Event()
+            self._submit(lambda: self._pump_tokens(request, tokens, abandoned))
+            started = False
+            try:
+                while True:
+                    try:
+                        token, error = tokens.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        raise self._timed_out("strumień") from None
+                    if token is _END:
+                        break
+                    started = True
+                    yield token
+            finally:
+                abandoned.set()
+            if error is None:
+                return
+            delay = None if started else self._retry_delay(error, attempt, deadline)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    # ---- wywołania asynchroniczne ----
+
+    async def _awith_retries(self, request: Callable[[], Awaitable[T]]) -> T:
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self._aacquire(deadline)
+            try:
+                return await asyncio.wait_for(request(), deadline - time.monotonic())
+            except Exception as error:
+                if time.monotonic() >= deadline:
+                    raise self._timed_out("odpowiedź") from error
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise
+            finally:
+                self.slots.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def acall(self, key: str, request: Callable[[], Awaitable[T]]) -> T:
+        if not self.coalesce:
+            return await self._awith_retries(request)
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get((loop, key))
+        if task is None:
+            task = loop.create_task(self._awith_retries(request))
+            self._tasks[(loop, key)] = task
+            task.add_done_callback(lambda done: self._finished_task(loop, key, done))
+        else:
+            metrics.inc("rag_llm_coalesced_total")
+        # shield: anulowanie jednego czekającego nie przerywa wywołania pozostałym
+        return await asyncio.shield(task)
+
+    def _finished_task(self, loop, key, task):
+        self._tasks.pop((loop, key), None)
+        if not task.cancelled():
+            task.exception()  # odebrany tutaj, gdy wszyscy czekający zdążyli zrezygnować
+
+    async def _pump(self, shared: _SharedStream, request: Callable[[], Awaitable[AsyncIterator[str]]]):
+        async def consume():
+            async for token in await request():
+                await shared.push(token)
+
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        error = None
+        try:
+            while True:
+                await self._aacquire(deadline)
+                try:
+                    await asyncio.wait_for(consume(), deadline - time.monotonic())
+                    return
+                except Exception as failure:
+                    if time.monotonic() >= deadline:
+                        raise self._timed_out("strumień") from failure
+                    delay = None if shared.tokens else self._retry_delay(failure, attempt, deadline)
+                    if delay is None:
+                        raise
+                finally:
+                    self.slots.release()
+                await asyncio.sleep(delay)
+                attempt += 1
+        except Exception as failure:
+            error = failure
+        finally:
+            await shared.close(error)
+
+    async def astream(self, key: str, request: Callable[[], Awaitable[AsyncIterator[str]]]) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        shared = self._streams.get((loop, key)) if self.coalesce else None
+        if shared is None:
+            shared = _SharedStream()
+            shared.task = loop.create_task(self._pump(shared, request))
+            if self.coalesce:
+                self._streams[(loop, key)] = shared
+                shared.task.add_done_callback(lambda _: self._drop_stream(loop, key, shared))
+        else:
+            metrics.inc("rag_llm_coalesced_total")
+        shared.subscribers += 1
+        try:
+            async for token in shared.follow():
+                yield token
+        finally:
+            shared.subscribers -= 1
+            if not shared.subscribers and not shared.task.done():
+                # Nikt już nie słucha (np. klient /ask się rozłączył) - przerywamy zapytanie do endpointu
+                self._drop_stream(loop, key, shared)
+                shared.task.cancel()
+
+    def _drop_stream(self, loop, key, shared):
+        if self._streams.get((loop, key)) is shared:
+            del self._streams[(loop, key)]
+
+
+def _caller_metrics() -> dict:
+    callers = list(_callers)
+    return {
+        "rag_llm_inflight": sum(caller.slots.active for caller in callers),
+        "rag_llm_queued": sum(caller.slots.queued for caller in callers),
+    }
+
+
+metrics.register_collector(_caller_metrics)
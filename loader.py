@@ -1,27 +1,82 @@
 import os
-import fitz  # PyMuPDF
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterator
 import markdown
+import time
 from pathlib import Path
 from langchain.schema import Document
+import metrics
+
+SUPPORTED_SUFFIXES = (".pdf", ".md")
+
+
+def load_file(file) -> list[Document]:
+    with metrics.span("load_file"):
+        return _load_file(Path(file))
+
+
+def _load_file(file: Path) -> list[Document]:
+    documents = []
+    if file.suffix.lower() == ".pdf":
+        import fitz  # PyMuPDF - ładowany dopiero przy pierwszym PDF-ie, ścieżka zapytań go nie potrzebuje
+        doc = fitz.open(file)
+        for i, page in enumerate(doc):
+            text = page.get_text()
+            metadata = {
+                "filename": file.name,
+                "page": i
+            }
+            documents.append(Document(page_content=text, metadata=metadata))
+    elif file.suffix.lower() == ".md":
+        with open(file, encoding="utf-8") as f:
+            md = f.read()
+            html = markdown.markdown(md)
+            metadata = {
+                "filename": file.name
+            }
+            documents.append(Document(page_content=html, metadata=metadata))
+    return documents
+
 
 def load_documents(folder_path: str) -> list[Document]:
     documents = []
-    for file in Path(folder_path).glob("*"):
-        if file.suffix.lower() == ".pdf":
-            doc = fitz.open(file)
-            for i, page in enumerate(doc):
-                text = page.get_text()
-                metadata = {
-                    "filename": file.name,
-                    "page": i
-                }
-                documents.append(Document(page_content=text, metadata=metadata))
-        elif file.suffix.lower() == ".md":
-            with open(file, encoding="utf-8") as f:
-                md = f.read()
-                html = markdown.markdown(md)
-                metadata = {
-                    "filename": file.name
-                }
-                documents.append(Document(page_content=html, metadata=metadata))
+    with metrics.span("load_documents"):
+        for file in Path(folder_path).glob("*"):
+            documents.extend(load_file(file))
     return documents
+
+
+def _extract_file(path: str) -> tuple[float, list[tuple[str, dict]]]:
+    # Uruchamiane w procesie roboczym - zwracamy proste krotki, tańsze do przesłania niż Document,
+    # oraz czas ekstrakcji, bo metryki procesu roboczego nie trafiają do procesu głównego
+    start = time.perf_counter()
+    pages = [(doc.page_content, doc.metadata) for doc in _load_file(Path(path))]
+    return time.perf_counter() - start, pages
+
+
+def iter_documents(folder_path: str, max_workers: int | None = None) -> Iterator[Document]:
+    """Równoległa ekstrakcja plików w puli procesów, zwracana strumieniowo.
+
+    Strony jednego pliku przychodzą razem i w kolejności, a w locie jest najwyżej
+    2 * max_workers plików, więc pamięć nie rośnie z rozmiarem katalogu.
+    """
+    files = [str(f) for f in sorted(Path(folder_path).glob("*")) if f.suffix.lower() in SUPPORTED_SUFFIXES]
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(files) <= 1:
+        for file in files:
+            yield from load_file(file)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        remaining = iter(files)
+        pending = deque(executor.submit(_extract_file, path) for path in islice(remaining, 2 * max_workers))
+        while pending:
+            seconds, pages = pending.popleft().result()
+            metrics.observe("load_file", seconds)
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append(executor.submit(_extract_file, next_path))
+            for text, metadata in pages:
+                yield Document(page_content=text, metadata=metadata)
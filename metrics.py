@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Próg (sekundy) dla logu wolnych zapytań; brak zmiennej = log wyłączony
+SLOW_QUERY_SECONDS = float(os.environ["SLOW_QUERY_SECONDS"]) if os.getenv("SLOW_QUERY_SECONDS") else None
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("rag.slow_query")
+
+_lock = threading.Lock()
+_histograms = {}  # etap -> [liczniki kubełków, suma, liczba]
+_counters = {}  # (nazwa, etykiety) -> wartość
+_collectors = []  # funkcje zwracające {nazwa metryki: wartość} w chwili odczytu
+_trace = ContextVar("rag_trace", default=None)
+_DISABLED = nullcontext()
+
+
+def observe(stage: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def _span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def span(stage: str):
+    """Mierzy czas etapu (histogram rag_stage_seconds{stage=...}); wyłączone metryki = pusty kontekst."""
+    return _span(stage) if METRICS_ENABLED else _DISABLED
+
+
+@contextmanager
+def _traced(name: str, **details):
+    spans = []
+    # Bez reset(token): trace bywa otwierany w generatorze asynchronicznym (/ask), kończonym w innym kontekście
+    previous = _trace.get()
+    _trace.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        total = time.perf_counter() - start
+        _trace.set(previous)
+        observe(name, total)
+        if SLOW_QUERY_SECONDS is not None and total >= SLOW_QUERY_SECONDS:
+            breakdown = {}
+            for stage, seconds in spans:
+                breakdown[stage] = round(breakdown.get(stage, 0.0) + seconds, 4)
+            logger.warning(json.dumps({"trace": name, "total_s": round(total, 4), "stages": breakdown, **details},
+                                      ensure_ascii=False))
+
+
+def trace(name: str, **details):
+    """Jak span, ale dodatkowo zbiera etapy wewnątrz (także w wątkach z asyncio.to_thread) do logu wolnych zapytań."""
+    return _traced(name, **details) if METRICS_ENABLED else _DISABLED
+
+
+def register_collector(collector: Callable[[], dict]):
+    with _lock:
+        _collectors.append(collector)
+
+
+def _labels(pairs) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def render() -> str:
+    """Wszystkie metryki w formacie tekstowym Prometheusa."""
+    with _lock:
+        histograms = {stage: (list(h[0]), h[1], h[2]) for stage, h in _histograms.items()}
+        counters = dict(_counters)
+        collectors = list(_collectors)
+
+    lines = [
+        "# HELP rag_stage_seconds Czas etapów pipeline'u RAG (zapytania i indeksowanie).",
+        "# TYPE rag_stage_seconds histogram",
+    ]
+    for stage, (buckets, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, value in zip(BUCKETS, buckets):
+            cumulative += value
+            lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {count}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+    for collector in collectors:
+        try:
+            values = collector()
+        except Exception:
+            continue
+        for name, value in values.items():
+            if value is not None:
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
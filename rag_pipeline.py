@@ -1,73 +1,957 @@
 from dotenv import load_dotenv
 import os
+import json
+import hashlib
+import uuid
+import threading
+import asyncio
+import math
+import pickle
+import time
+import shutil
+import weakref
+from contextlib import contextmanager
+import faiss
+import numpy as np
+from pathlib import Path
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
+from langchain.chains import RetrievalQA, LLMChain
+from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 from langchain.llms.base import LLM
-from huggingface_hub import InferenceClient
-from typing import Optional, List
+from langchain.chains.retrieval_qa.prompt import PROMPT
+from langchain_core.outputs import GenerationChunk
+from huggingface_hub import InferenceClient, AsyncInferenceClient
+from typing import Optional, List, Iterator, AsyncIterator
+try:
+    import fcntl
+except ImportError:  # Windows - zostaje tylko blokada w obrębie procesu
+    fcntl = None
 from pydantic import PrivateAttr, Field
+from embedding_cache import CachedEmbeddings
+import metrics
+from answer_cache import AnswerCache, CachedQAChain
+from spec_table import SpecTable, SpecTableBuilder, SpecRoutedQAChain, SPEC_PROMPT, SPEC_TABLE_NAME, extract_specs, route_query, query_entities, format_rows, rows_to_documents
+from loader import load_file, iter_documents, SUPPORTED_SUFFIXES
+from context_assembly import AssembledContextRetriever, assemble_context
+from llm_client import ResilientCaller, request_key, LLM_TIMEOUT, LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES, LLM_DEADLINE
 
 # Załaduj zmienne środowiskowe z pliku `.env`
 load_dotenv()
 print("Token z env:", os.getenv("HUGGINGFACEHUB_API_TOKEN"))
 
 class HFInferenceLLM(LLM):
+    """LLM z Hugging Face Inference API.
+
+    Klient synchroniczny korzysta ze współdzielonej sesji HTTP huggingface_hub, a asynchroniczny
+    jest tworzony raz na pętlę zdarzeń, więc połączenia są utrzymywane między zapytaniami.
+    Limit równoczesnych zapytań, ponawianie, termin i łączenie identycznych promptów - ResilientCaller.
+    """
     model_name: str = Field(...)
     token: Optional[str] = Field(default=None)
     temperature: float = 0.5
     max_new_tokens: int = 512
+    # Własny serwer zgodny z API OpenAI (np. fake_inference_server.py) zamiast Hugging Face
+    base_url: Optional[str] = Field(default_factory=lambda: os.getenv("HF_INFERENCE_BASE_URL"))
+    timeout: float = LLM_TIMEOUT
+    max_concurrency: int = LLM_MAX_CONCURRENCY
+    max_retries: int = LLM_MAX_RETRIES
+    deadline: float = LLM_DEADLINE
+    coalesce: bool = True
 
     _client: InferenceClient = PrivateAttr()
+    _async_clients: weakref.WeakKeyDictionary = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _caller: ResilientCaller = PrivateAttr()
 
     def __init__(self, **data):
         if not data.get("token"):
             data["token"] = os.getenv("HUGGINGFACEHUB_API_TOKEN")
         super().__init__(**data)
-        self._client = InferenceClient(token=self.token)
+        self._client = self._new_client(InferenceClient)
+        self._caller = ResilientCaller(self.max_concurrency, self.max_retries, self.deadline, self.coalesce)
+
+    def _new_client(self, client_class):
+        return client_class(token=self.token, timeout=self.timeout, base_url=self.base_url)
+
+    def _get_async_client(self) -> AsyncInferenceClient:
+        # Pula połączeń klienta asynchronicznego jest związana z pętlą zdarzeń - jeden klient na pętlę
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = self._new_client(AsyncInferenceClient)
+        return client
 
     @property
     def _llm_type(self) -> str:
         return "huggingface_inference"
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
-        messages = [
-            {"role": "user", "content": prompt}
-        ]
-        response = self._client.chat.completions.create(
+    def _request(self, prompt: str, stop: Optional[List[str]], stream: bool = False) -> dict:
+        return dict(
             model=self.model_name,
-            messages=messages,
+            messages=[{"role": "user", "content": prompt}],
             max_tokens=self.max_new_tokens,
             temperature=self.temperature,
             stop=stop,
+            stream=stream,
         )
-        generated_text = response.choices[0].message["content"]
-        return generated_text
+
+    @staticmethod
+    def _text(response) -> str:
+        usage = getattr(response, "usage", None)
+        if usage is not None and usage.completion_tokens:
+            metrics.inc("rag_llm_tokens_total", usage.completion_tokens)
+        return response.choices[0].message["content"]
+
+    @staticmethod
+    def _tokens(chunks) -> Iterator[str]:
+        for chunk in chunks:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                metrics.inc("rag_llm_tokens_total")
+                yield token
+
+    @staticmethod
+    async def _atokens(chunks) -> AsyncIterator[str]:
+        async for chunk in chunks:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                metrics.inc("rag_llm_tokens_total")
+                yield token
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        request = self._request(prompt, stop)
+        with metrics.span("llm_call"):
+            return self._caller.call(request_key(request), lambda: self._text(self._client.chat.completions.create(**request)))
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        request = self._request(prompt, stop)
+
+        async def complete():
+            return self._text(await self._get_async_client().chat.completions.create(**request))
+
+        with metrics.span("llm_call"):
+            return await self._caller.acall(request_key(request), complete)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> Iterator[GenerationChunk]:
+        request = self._request(prompt, stop, stream=True)
+        start = time.perf_counter()
+        first = True
+        for token in self._caller.stream(lambda: self._tokens(self._client.chat.completions.create(**request))):
+            if first:
+                metrics.observe("llm_first_token", time.perf_counter() - start)
+                first = False
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield GenerationChunk(text=token)
+        metrics.observe("llm_stream", time.perf_counter() - start)
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> AsyncIterator[GenerationChunk]:
+        request = self._request(prompt, stop, stream=True)
+
+        async def open_stream():
+            return self._atokens(await self._get_async_client().chat.completions.create(**request))
+
+        start = time.perf_counter()
+        first = True
+        async for token in self._caller.astream(request_key(request), open_stream):
+            if first:
+                metrics.observe("llm_first_token", time.perf_counter() - start)
+                first = False
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+            yield GenerationChunk(text=token)
+        metrics.observe("llm_stream", time.perf_counter() - start)
+
+
+class LocalStubLLM(LLM):
+    """Deterministyczny zamiennik HFInferenceLLM do testów i benchmarków - bez sieci.
+
+    Odpowiada stałym szablonem zależnym od pytania i długości kontekstu,
+    a przy strumieniowaniu oddaje kolejne słowa co `token_delay` sekund.
+    """
+    token_delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "local_stub"
+
+    def _answer(self, prompt: str) -> str:
+        question = prompt.rsplit("Question:", 1)[-1].split("\n", 1)[0].strip()
+        return f"Odpowiedź testowa ({len(prompt)} znaków promptu) na pytanie: {question}"
+
+    def _tokens(self, prompt: str) -> List[str]:
+        words = self._answer(prompt).split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        return self._answer(prompt)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> Iterator[GenerationChunk]:
+        for token in self._tokens(prompt):
+            yield GenerationChunk(text=token)
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> AsyncIterator[GenerationChunk]:
+        for token in self._tokens(prompt):
+            await asyncio.sleep(self.token_delay)
+            yield GenerationChunk(text=token)
+
+
+MANIFEST_NAME = "manifest.json"
+EMBED_BATCH_SIZE = 64  # liczba stron dzielonych i embedowanych naraz
+RETRIEVER_K = 4
+INDEX_CONFIG_NAME = "index_config.json"
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+MIN_IVFPQ_VECTORS = 256
+CURRENT_NAME = "CURRENT"
+VERSIONS_DIR = "versions"
+LEGACY_VERSION = "legacy"
+KEEP_VERSIONS = 3
+RELOAD_CHECK_INTERVAL = float(os.getenv("RELOAD_CHECK_INTERVAL", 1.0))  # sekundy
+# Domyślne parametry budowy/wyszukiwania; nlist=0 oznacza dobór automatyczny (~4*sqrt(n))
+DEFAULT_INDEX_PARAMS = {
+    "flat": {},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "ivfpq": {"nlist": 0, "m": 8, "nbits": 8, "nprobe": 8},
+}
+
+
+def _get_splitter():
+    return RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+# Współdzielone w całym procesie (wszystkie sesje i reruny Streamlit, wszystkie requesty FastAPI)
+_resources = {}
+_resource_locks = {}
+_resources_lock = threading.Lock()
+_version_checks = {}  # ścieżka -> (czas sprawdzenia, wersja)
+_write_locks = {}
+
+
+def _get_resource(key, factory):
+    resource = _resources.get(key)
+    if resource is None:
+        # Blokada per zasób: ładowanie nowego indeksu nie wstrzymuje pobierania innych zasobów
+        with _resources_lock:
+            lock = _resource_locks.setdefault(key, threading.Lock())
+        with lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = factory()
+                _resources[key] = resource
+    return resource
+
+
+def _versioned_resource(kind, persist_path, version, factory):
+    path_key = str(Path(persist_path))
+    resource = _get_resource((kind, path_key, version), factory)
+    # Starsze wersje wypadają z cache; zapytania w toku trzymają własne referencje i kończą się normalnie
+    with _resources_lock:
+        for key in [k for k in _resources if k[:2] == (kind, path_key) and k[2] != version]:
+            del _resources[key]
+            _resource_locks.pop(key, None)
+    return resource
+
+
+def _checked_version(persist_path):
+    # Hot-reload: wskaźnik CURRENT sprawdzamy najwyżej raz na RELOAD_CHECK_INTERVAL sekund
+    path_key = str(Path(persist_path))
+    now = time.monotonic()
+    checked = _version_checks.get(path_key)
+    if checked is None or now - checked[0] >= RELOAD_CHECK_INTERVAL:
+        checked = (now, index_version(persist_path))
+        _version_checks[path_key] = checked
+    return checked[1]
+
+
+def get_embedder():
+    # Model sentence-transformers ładujemy raz; chunki przechodzą przez cache na dysku
+    return _get_resource(
+        ("embedder", EMBEDDING_MODEL),
+        lambda: CachedEmbeddings(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL), EMBEDDING_MODEL),
+    )
+
+
+def use_embedder(embedder):
+    """Ustawia embedder procesu zamiast domyślnego (benchmark: model z cache w katalogu tymczasowym albo bez cache)."""
+    with _resources_lock:
+        _resources[("embedder", EMBEDDING_MODEL)] = embedder
+
+
+def get_llm():
+    return _get_resource(("llm",), _build_llm)
+
+
+def _vectorstore_at(persist_path, version):
+    return _versioned_resource("vectorstore", persist_path, version, lambda: load_vectorstore(persist_path, version))
+
+
+def _spec_table_at(persist_path, version):
+    return _versioned_resource("specs", persist_path, version, lambda: SpecTable.load(_index_dir_for(persist_path, version)))
+
+
+def get_vectorstore(persist_path="vectorstore/"):
+    return _vectorstore_at(persist_path, _checked_version(persist_path))
+
+
+def get_spec_table(persist_path="vectorstore/"):
+    return _spec_table_at(persist_path, _checked_version(persist_path))
+
+
+def _answer_cache_factory(persist_path):
+    cache = AnswerCache(get_embedder(), lambda: _checked_version(persist_path),
+                        entities_fn=lambda query: query_entities(query, get_spec_table(persist_path)))
+    metrics.register_collector(lambda: {f"rag_answer_cache_{name}": value for name, value in cache.stats().items()})
+    return cache
+
+
+def get_answer_cache(persist_path="vectorstore/"):
+    # Osobny zasób niż łańcuch, żeby statystyki przetrwały przeładowanie indeksu
+    return _get_resource(("answer_cache", str(Path(persist_path))), lambda: _answer_cache_factory(persist_path))
+
+
+def get_qa_chain(persist_path="vectorstore/"):
+    version = _checked_version(persist_path)
+    return _versioned_resource(
+        "qa_chain", persist_path, version,
+        lambda: CachedQAChain(
+            SpecRoutedQAChain(
+                build_qa_chain(_vectorstore_at(persist_path, version)),
+                _spec_table_at(persist_path, version),
+                get_llm(),
+            ),
+            get_answer_cache(persist_path),
+            version,
+        ),
+    )
+
+
+# ---- Wersje indeksu: każda zmiana trafia do nowego katalogu, publikacja przez podmianę CURRENT ----
+
+def index_version(persist_path="vectorstore/") -> Optional[str]:
+    try:
+        return (Path(persist_path) / CURRENT_NAME).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        # Stary układ: indeks bezpośrednio w vectorstore/, wersją jest stan manifestu
+        try:
+            stat = (Path(persist_path) / MANIFEST_NAME).stat()
+        except FileNotFoundError:
+            return LEGACY_VERSION if (Path(persist_path) / "index.faiss").exists() else None
+        return f"{LEGACY_VERSION}-{stat.st_mtime_ns}"
+
+
+def _index_dir_for(persist_path, version) -> Optional[Path]:
+    if version is None:
+        return None
+    if version.startswith(LEGACY_VERSION):
+        return Path(persist_path)
+    return Path(persist_path) / VERSIONS_DIR / version
+
+
+def current_index_dir(persist_path="vectorstore/") -> Optional[Path]:
+    return _index_dir_for(persist_path, index_version(persist_path))
+
+
+def index_exists(persist_path="vectorstore/") -> bool:
+    return index_version(persist_path) is not None
+
+
+@contextmanager
+def _write_lock(persist_path):
+    # Jeden zapisujący naraz: blokada w procesie + flock między procesami (Streamlit, uvicorn)
+    root = Path(persist_path)
+    root.mkdir(parents=True, exist_ok=True)
+    with _resources_lock:
+        lock = _write_locks.setdefault(str(root), threading.Lock())
+    with lock, open(root / ".lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _version_order(index_dir: Path):
+    # Nazwy z dawnego formatu (data-godzina-hex) są starsze od każdej liczbowej
+    return (index_dir.name.isdigit(), index_dir.name)
+
+
+@contextmanager
+def _new_index_dir(persist_path):
+    """Świeży katalog wersji; jeśli nie zostanie opublikowany (błąd, brak dokumentów), jest usuwany.
+
+    Nazwa to czas w ns (stała szerokość), ściśle większa od każdej istniejącej wersji - kolejność
+    nazw jest kolejnością publikacji. Wywoływane pod _write_lock.
+    """
+    versions_dir = Path(persist_path) / VERSIONS_DIR
+    latest = max((int(d.name) for d in versions_dir.glob("*") if d.name.isdigit()), default=0)
+    version = f"{max(time.time_ns(), latest + 1):020d}"
+    index_dir = versions_dir / version
+    index_dir.mkdir(parents=True)
+    try:
+        yield index_dir
+    finally:
+        if index_version(persist_path) != version:
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def _publish(persist_path, index_dir: Path):
+    root = Path(persist_path)
+    tmp_file = root / f"{CURRENT_NAME}.tmp"
+    tmp_file.write_text(index_dir.name, encoding="utf-8")
+    os.replace(tmp_file, root / CURRENT_NAME)
+    _version_checks.pop(str(root), None)
+
+    # Kilka poprzednich wersji zostaje na chwilę dla procesów, które jeszcze ich używają
+    older = sorted((d for d in (root / VERSIONS_DIR).iterdir() if d.is_dir() and d.name != index_dir.name), key=_version_order)
+    for stale in older[:max(0, len(older) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def _update_hash(digest, doc):
+    digest.update(doc.page_content.encode("utf-8"))
+    digest.update(b"\x00")
+
+
+def content_hash(documents) -> str:
+    # Hash treści wyciągniętej z pliku (strony w kolejności) - zmiana PDF-a = nowy hash
+    digest = hashlib.sha256()
+    for doc in documents:
+        _update_hash(digest, doc)
+    return digest.hexdigest()
+
+
+def file_hash(path) -> str:
+    # Hash surowych bajtów pliku - niezmieniony plik pomijamy bez parsowania
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
-def create_vectorstore(documents, persist_path="vectorstore/"):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-    chunks = splitter.split_documents(documents)  # <-- to jest kluczowa zmiana
-    embedder = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectordb = FAISS.from_documents(chunks, embedding=embedder)
-    vectordb.save_local(persist_path)
+def _read_json(path: Path, default: dict) -> dict:
+    if not path.exists():
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(data: dict, path: Path):
+    tmp_file = path.with_suffix(".json.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, path)
+
+
+def load_manifest(persist_path="vectorstore/") -> dict:
+    index_dir = current_index_dir(persist_path)
+    if index_dir is None:
+        return {"files": {}}
+    if not (index_dir / MANIFEST_NAME).exists():
+        return _manifest_from_docstore(_load_for_update(index_dir))
+    return _read_json(index_dir / MANIFEST_NAME, {"files": {}})
+
+
+def save_manifest(manifest: dict, index_dir):
+    _write_json(manifest, Path(index_dir) / MANIFEST_NAME)
+
+
+def _refresh_vector_ids(manifest: dict, vectordb):
+    # Pozycje wektorów w FAISS przesuwają się po usunięciu, więc liczymy je od nowa
+    positions = {doc_id: pos for pos, doc_id in vectordb.index_to_docstore_id.items()}
+    for entry in manifest["files"].values():
+        entry["vector_ids"] = [positions[chunk_id] for chunk_id in entry["chunk_ids"]]
+
+
+def _read_index_config(index_dir) -> dict:
+    return _read_json(Path(index_dir) / INDEX_CONFIG_NAME, {"index_type": "flat", "params": {}})
+
+
+def load_index_config(persist_path="vectorstore/") -> dict:
+    index_dir = current_index_dir(persist_path)
+    return _read_index_config(index_dir) if index_dir else {"index_type": "flat", "params": {}}
+
+
+def _index_file(index_dir, index_type) -> Path:
+    # Płaski indeks z save_local zawsze zostaje - na nim robimy przyrostowe zmiany
+    return Path(index_dir) / ("index.faiss" if index_type == "flat" else f"index.{index_type}.faiss")
+
+
+def _apply_search_params(index, index_type, params):
+    if index_type == "hnsw":
+        index.hnsw.efSearch = params["efSearch"]
+    elif index_type == "ivfpq" and faiss.try_extract_index_ivf(index) is not None:
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+
+
+def build_index(vectors, index_type="flat", params=None):
+    """Buduje indeks FAISS danego typu z macierzy wektorów (n x d, float32), w tej samej kolejności.
+
+    Zwraca (indeks, faktyczny typ, faktyczne parametry) - przy małym katalogu IVF-PQ jest
+    przycinany albo zastępowany płaskim, a do index_config.json trafia to, co naprawdę zbudowano.
+    """
+    if index_type not in DEFAULT_INDEX_PARAMS:
+        raise ValueError(f"Nieznany typ indeksu: {index_type}. Dostępne: {', '.join(DEFAULT_INDEX_PARAMS)}")
+    params = {**DEFAULT_INDEX_PARAMS[index_type], **(params or {})}
+    n, dim = vectors.shape
+    if index_type == "ivfpq" and n < MIN_IVFPQ_VECTORS:
+        # Za mało punktów do treningu kwantyzatora - przeszukanie dokładne i tak jest tu tanie
+        index_type, params = "flat", {}
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+    else:
+        # Przy małych katalogach przycinamy liczbę list i bity PQ: faiss chce >= 39 punktów
+        # treningowych na centroid, zarówno listy IVF (nlist), jak i kodu PQ (2**nbits)
+        nlist = params["nlist"] or int(4 * math.sqrt(n))
+        nlist = max(1, min(nlist, n // 39))
+        nbits = max(1, min(params["nbits"], int(math.log2(n / 39))))
+        params = {**params, "nlist": nlist, "nbits": nbits}
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, params["m"], nbits)
+        index.train(vectors)
+    index.add(vectors)
+    _apply_search_params(index, index_type, params)
+    return index, index_type, params
+
+
+def _write_serving_index(vectordb, index_dir, index_type, index_params=None):
+    """Zapisuje indeks używany do wyszukiwania (obok płaskiego) i jego parametry w index_config.json.
+
+    W konfiguracji jest faktycznie zbudowany typ i parametry, a w "requested" - zamówione
+    (od nich startuje każda przebudowa, np. gdy katalog urośnie do rozmiaru IVF-PQ).
+    """
+    requested = {"index_type": index_type, "params": {**DEFAULT_INDEX_PARAMS[index_type], **(index_params or {})}}
+    built_type, params = "flat", {}
+    if index_type != "flat":
+        vectors = vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+        index, built_type, params = build_index(vectors, index_type, requested["params"])
+        if built_type != "flat":
+            faiss.write_index(index, str(_index_file(index_dir, built_type)))
+    config = {"index_type": built_type, "params": params, "requested": requested,
+              "dim": vectordb.index.d, "ntotal": vectordb.index.ntotal}
+    _write_json(config, Path(index_dir) / INDEX_CONFIG_NAME)
+
+
+def _requested_index(config: dict) -> tuple:
+    # Konfiguracje sprzed pola "requested" opisywały wprost zamówiony typ
+    requested = config.get("requested", config)
+    return requested["index_type"], requested["params"]
+
+
+def _read_index(path: Path):
+    # mmap tylko do odczytu - kilka workerów uvicorn/Streamlit współdzieli te same strony w page cache
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(str(path), flags)
+    except RuntimeError:
+        return faiss.read_index(str(path))
+
+
+def _split_with_ids(documents):
+    with metrics.span("split"):
+        chunks = _get_splitter().split_documents(documents)
+    ids = [uuid.uuid4().hex for _ in chunks]
+    return chunks, ids
+
+
+def create_vectorstore(documents, persist_path="vectorstore/", batch_size=EMBED_BATCH_SIZE,
+                       index_type=None, index_params=None, file_hashes=None):
+    """Buduje indeks od zera. `documents` może być listą albo generatorem (np. iter_documents).
+
+    Strony są dzielone i embedowane partiami po `batch_size`, więc w pamięci trzymamy
+    tylko bieżącą partię, a ekstrakcja kolejnych plików trwa w tle.
+    `index_type` ("flat", "hnsw", "ivfpq"; domyślnie FAISS_INDEX_TYPE) wybiera indeks do wyszukiwania.
+    Nowa wersja powstaje w osobnym katalogu i jest publikowana dopiero w całości.
+    `file_hashes` (nazwa pliku -> file_hash) trafia do manifestu, żeby sync pomijał niezmienione pliki.
+    """
+    index_type = index_type or INDEX_TYPE
+    if index_type not in DEFAULT_INDEX_PARAMS:
+        raise ValueError(f"Nieznany typ indeksu: {index_type}. Dostępne: {', '.join(DEFAULT_INDEX_PARAMS)}")
+    with metrics.trace("create_vectorstore"), _write_lock(persist_path), _new_index_dir(persist_path) as index_dir:
+        vectordb = _build_into(documents, index_dir, batch_size, index_type, index_params, file_hashes)
+        if vectordb is not None:
+            _publish(persist_path, index_dir)
+        return vectordb
+
+
+def _build_into(documents, index_dir, batch_size=EMBED_BATCH_SIZE, index_type="flat", index_params=None, file_hashes=None):
+    embedder = get_embedder()
+    vectordb = None
+    specs = SpecTableBuilder()
+    files = {}
+    hashes = {}
+    batch = []
+
+    def flush(vectordb, batch):
+        chunks, ids = _split_with_ids(batch)
+        for chunk, chunk_id in zip(chunks, ids):
+            files[chunk.metadata.get("filename")]["chunk_ids"].append(chunk_id)
+        if not chunks:
+            return vectordb
+        if vectordb is None:
+            return FAISS.from_documents(chunks, embedding=embedder, ids=ids)
+        vectordb.add_documents(chunks, ids=ids)
+        return vectordb
+
+    for doc in documents:
+        filename = doc.metadata.get("filename")
+        if filename not in files:
+            files[filename] = {"hash": None, "file_hash": (file_hashes or {}).get(filename), "pages": 0, "chunk_ids": []}
+            hashes[filename] = hashlib.sha256()
+        _update_hash(hashes[filename], doc)
+        files[filename]["pages"] += 1
+        specs.add(doc)
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            vectordb = flush(vectordb, batch)
+            batch = []
+    if batch:
+        vectordb = flush(vectordb, batch)
+    if vectordb is None:
+        return None
+    with metrics.span("save_local"):
+        vectordb.save_local(str(index_dir))
+    with metrics.span("build_serving_index"):
+        _write_serving_index(vectordb, index_dir, index_type, index_params)
+    specs.finish().save(index_dir)
+
+    for filename, digest in hashes.items():
+        files[filename]["hash"] = digest.hexdigest()
+    manifest = {"files": files}
+    _refresh_vector_ids(manifest, vectordb)
+    save_manifest(manifest, index_dir)
     return vectordb
 
 
-def load_vectorstore(persist_path="vectorstore/"):
-    embedder = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    return FAISS.load_local(persist_path, embedder, allow_dangerous_deserialization=True)
+def load_vectorstore(persist_path="vectorstore/", version=None):
+    """Wczytuje indeks do wyszukiwania (typ z index_config.json) przez mmap, tylko do odczytu.
+
+    Bez `version` - bieżąca opublikowana wersja. `exact_index` to płaski index.faiss tej wersji
+    (też mmap) - dokładne wektory kandydatów do składania kontekstu, także przy IVF-PQ.
+    """
+    index_dir = _index_dir_for(persist_path, version or index_version(persist_path))
+    if index_dir is None:
+        raise FileNotFoundError(f"Brak indeksu w {persist_path}")
+    config = _read_index_config(index_dir)
+    index = _read_index(_index_file(index_dir, config["index_type"]))
+    _apply_search_params(index, config["index_type"], config["params"])
+    with open(index_dir / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    vectordb = FAISS(get_embedder(), index, docstore, index_to_docstore_id)
+    vectordb.exact_index = index if config["index_type"] == "flat" else _read_index(_index_file(index_dir, "flat"))
+    return vectordb
+
+
+def _load_for_update(index_dir):
+    # Zapisywalna kopia płaskiego indeksu - źródło prawdy dla zmian przyrostowych
+    return FAISS.load_local(str(index_dir), get_embedder(), allow_dangerous_deserialization=True)
+
+
+def _manifest_from_docstore(vectordb) -> dict:
+    # Indeks sprzed manifestu: pliki i chunki odtwarzamy z metadata["filename"] w docstore.
+    # Hash nieznany, więc pierwszy upsert takiego pliku zawsze podmienia jego chunki.
+    files = {}
+    for doc_id in vectordb.index_to_docstore_id.values():
+        doc = vectordb.docstore.search(doc_id)
+        entry = files.setdefault(doc.metadata.get("filename"), {"hash": None, "pages": set(), "chunk_ids": []})
+        entry["pages"].add(doc.metadata.get("page"))
+        entry["chunk_ids"].append(doc_id)
+    for entry in files.values():
+        entry["pages"] = len(entry["pages"])
+    return {"files": files}
+
+
+def _spec_table_from_docstore(vectordb) -> SpecTable:
+    texts = {}
+    for doc_id in vectordb.index_to_docstore_id.values():
+        doc = vectordb.docstore.search(doc_id)
+        texts.setdefault(doc.metadata.get("filename"), []).append(doc.page_content)
+    table = SpecTable()
+    for filename, parts in texts.items():
+        table.upsert(extract_specs(filename, "\n".join(parts)))
+    return table
 
 
-def build_qa_chain(vectordb):
-    llm = HFInferenceLLM(
+def _index_state(source_dir):
+    """Manifest i tabela specyfikacji wersji (plus indeks do zmian, jeśli trzeba go było wczytać).
+
+    Indeks zbudowany przed wprowadzeniem manifestu/tabeli jest migrowany na podstawie docstore,
+    żeby pierwszy upsert nie dublował chunków, a delete widział wszystkie pliki.
+    """
+    vectordb = None
+    manifest = _read_json(source_dir / MANIFEST_NAME, None)
+    if manifest is None:
+        vectordb = _load_for_update(source_dir)
+        manifest = _manifest_from_docstore(vectordb)
+    if (source_dir / SPEC_TABLE_NAME).exists():
+        spec_table = SpecTable.load(source_dir)
+    else:
+        vectordb = vectordb or _load_for_update(source_dir)
+        spec_table = _spec_table_from_docstore(vectordb)
+    return manifest, spec_table, vectordb
+
+
+def _positions(vectordb, chunk_ids) -> list:
+    wanted = set(chunk_ids)
+    return [pos for pos, doc_id in vectordb.index_to_docstore_id.items() if doc_id in wanted]
+
+
+def _remove_positions(index, removed):
+    """Usuwa wektory z podanych pozycji tak, jak FAISS.delete z płaskiego: kolejne pozycje przesuwają się w dół."""
+    removed = np.sort(np.asarray(removed, dtype=np.int64))
+    index.remove_ids(removed)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return
+    # IVF zostawia pozostałym wektorom stare id - numerujemy je od nowa jak pozycje w płaskim
+    invlists = ivf.invlists
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if not size:
+            continue
+        ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy()
+        codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+        ids -= np.searchsorted(removed, ids)
+        invlists.update_entries(list_no, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+
+
+def _update_serving_index(vectordb, source_dir, index_dir, removed, added):
+    """Nanosi zmianę na indeks wyszukiwania poprzedniej wersji zamiast budować go od nowa.
+
+    `removed` - pozycje usuniętych wektorów w poprzedniej wersji, `added` - liczba nowych na końcu.
+    Od zera budujemy tylko, gdy zmienia się typ (np. katalog dorósł do IVF-PQ) albo gdy HNSW
+    traci wektory (nie obsługuje usuwania). Kwantyzator IVF-PQ zostaje z ostatniej pełnej budowy.
+    """
+    config = _read_index_config(source_dir)
+    index_type = config["index_type"]
+    requested_type, requested_params = _requested_index(config)
+    if index_type != requested_type or (index_type == "hnsw" and removed):
+        _write_serving_index(vectordb, index_dir, requested_type, requested_params)
+        return
+    if index_type != "flat":
+        index = faiss.read_index(str(_index_file(source_dir, index_type)))
+        if removed:
+            _remove_positions(index, removed)
+        if added:
+            index.add(vectordb.index.reconstruct_n(vectordb.index.ntotal - added, added))
+        faiss.write_index(index, str(_index_file(index_dir, index_type)))
+    _write_json({**config, "ntotal": vectordb.index.ntotal}, Path(index_dir) / INDEX_CONFIG_NAME)
+
+
+def _save_version(vectordb, manifest, spec_table, source_dir, index_dir, removed=(), added=0):
+    _refresh_vector_ids(manifest, vectordb)
+    with metrics.span("save_local"):
+        vectordb.save_local(str(index_dir))
+    with metrics.span("update_serving_index"):
+        _update_serving_index(vectordb, source_dir, index_dir, removed, added)
+    spec_table.save(index_dir)
+    save_manifest(manifest, index_dir)
+
+
+def _apply_changes(persist_path, upserts=(), deletes=(), prune=False, progress=None) -> dict:
+    """Nanosi zmiany wielu plików pod jedną blokadą zapisu i publikuje je jako jedną wersję.
+
+    `upserts` - krotki (filename, raw_hash, load): load() zwraca strony pliku i jest wołane tylko,
+    gdy raw_hash (file_hash, None = nieznany) różni się od zapisanego w manifeście.
+    `deletes` - pliki do usunięcia; `prune` - usuwa też wszystkie pliki spoza `upserts`.
+    Zwraca status pliku: "added", "replaced", "unchanged", "deleted" albo "missing" (nie było go w indeksie).
+    """
+    statuses = {}
+    with _write_lock(persist_path):
+        source_dir = current_index_dir(persist_path)
+        with _new_index_dir(persist_path) as index_dir:
+            if source_dir is None:
+                if progress:
+                    progress("embedding")
+                documents = (doc for _, _, load in upserts for doc in load())
+                hashes = {filename: raw_hash for filename, raw_hash, _ in upserts}
+                built = _build_into(documents, index_dir, index_type=INDEX_TYPE, file_hashes=hashes) is not None
+                if built:
+                    _publish(persist_path, index_dir)
+                files = load_manifest(persist_path)["files"] if built else {}
+                statuses.update({filename: "added" if filename in files else "unchanged" for filename, _, _ in upserts})
+                statuses.update({filename: "missing" for filename in deletes})
+                return statuses
+
+            manifest, spec_table, vectordb = _index_state(source_dir)
+            files = manifest["files"]
+            changed = []
+            for filename, raw_hash, load in upserts:
+                previous = files.get(filename)
+                if previous and raw_hash is not None and previous.get("file_hash") == raw_hash:
+                    statuses[filename] = "unchanged"
+                    continue
+                if progress:
+                    progress("parsing")
+                documents = load()
+                documents_hash = content_hash(documents)
+                if previous and previous["hash"] == documents_hash:
+                    # Inne bajty, ta sama treść - nowy hash pliku zapisze się przy najbliższej zmianie
+                    previous["file_hash"] = raw_hash
+                    statuses[filename] = "unchanged"
+                    continue
+                changed.append((filename, raw_hash, documents, documents_hash, previous))
+
+            deletes = list(deletes)
+            if prune:
+                kept = {filename for filename, _, _ in upserts}
+                deletes += [filename for filename in files if filename not in kept]
+            deleted = [filename for filename in deletes if filename in files]
+            statuses.update({filename: "missing" for filename in deletes if filename not in files})
+            if not changed and not deleted:
+                return statuses
+
+            if progress:
+                progress("embedding")
+            vectordb = vectordb or _load_for_update(source_dir)
+            # Pozycje usuwanych wektorów liczymy względem poprzedniej wersji, nowe dochodzą na końcu
+            old_ids = [chunk_id for filename in deleted for chunk_id in files.pop(filename)["chunk_ids"]]
+            old_ids += [chunk_id for *_, previous in changed if previous for chunk_id in previous["chunk_ids"]]
+            removed = _positions(vectordb, old_ids)
+            if removed:
+                vectordb.delete([vectordb.index_to_docstore_id[pos] for pos in removed])
+            for filename in deleted:
+                spec_table.remove(filename)
+                statuses[filename] = "deleted"
+
+            specs = SpecTableBuilder(spec_table)
+            added = 0
+            for filename, raw_hash, documents, documents_hash, previous in changed:
+                chunks, ids = _split_with_ids(documents)
+                if chunks:
+                    vectordb.add_documents(chunks, ids=ids)
+                added += len(chunks)
+                files[filename] = {"hash": documents_hash, "file_hash": raw_hash, "pages": len(documents), "chunk_ids": ids}
+                for doc in documents:
+                    specs.add(doc)
+                statuses[filename] = "replaced" if previous else "added"
+
+            if progress:
+                progress("writing")
+            _save_version(vectordb, manifest, specs.finish(), source_dir, index_dir, removed, added)
+            _publish(persist_path, index_dir)
+    return statuses
+
+
+def upsert_documents(filename, documents, persist_path="vectorstore/", progress=None) -> str:
+    """Dodaje lub podmienia chunki jednego pliku, nie ruszając reszty indeksu.
+
+    Zwraca "added", "replaced" albo "unchanged" (ten sam hash treści).
+    `progress` (opcjonalnie) dostaje nazwę bieżącego etapu.
+    """
+    return _apply_changes(persist_path, [(filename, None, lambda: documents)], progress=progress)[filename]
+
+
+def upsert_file(path, persist_path="vectorstore/", progress=None) -> str:
+    path = Path(path)
+    with metrics.trace("upsert_file", filename=path.name):
+        return _apply_changes(persist_path, [(path.name, file_hash(path), lambda: load_file(path))], progress=progress)[path.name]
+
+
+def delete_document(filename, persist_path="vectorstore/", progress=None) -> bool:
+    """Usuwa z indeksu wszystkie chunki danego pliku. Zwraca False, jeśli pliku nie było w indeksie."""
+    return _apply_changes(persist_path, deletes=[filename], progress=progress)[filename] == "deleted"
+
+
+def sync_vectorstore(folder_path, persist_path="vectorstore/") -> dict:
+    """Doprowadza indeks do stanu folderu jedną nową wersją: parsuje tylko pliki o zmienionych bajtach."""
+    files = [f for f in sorted(Path(folder_path).glob("*")) if f.suffix.lower() in SUPPORTED_SUFFIXES]
+    # Hash liczony przed parsowaniem - plik zmieniony w trakcie zostanie przeliczony przy kolejnym sync
+    hashes = {f.name: file_hash(f) for f in files}
+    if not index_exists(persist_path):
+        create_vectorstore(iter_documents(folder_path), persist_path, file_hashes=hashes)
+        return {f.name: "added" for f in files}
+    upserts = [(f.name, hashes[f.name], lambda f=f: load_file(f)) for f in files]
+    return _apply_changes(persist_path, upserts, prune=True)
+
+
+def _index_metrics(persist_path="vectorstore/") -> dict:
+    index_dir = current_index_dir(persist_path)
+    if index_dir is None:
+        return {}
+    return {
+        "rag_index_vectors": _read_index_config(index_dir).get("ntotal"),
+        "rag_index_bytes": sum(f.stat().st_size for f in index_dir.iterdir() if f.is_file()),
+    }
+
+
+metrics.register_collector(_index_metrics)
+
+
+def _build_llm():
+    # LLM_BACKEND=stub - lokalny deterministyczny model zamiast Hugging Face (testy bez sieci)
+    if os.getenv("LLM_BACKEND") == "stub":
+        return LocalStubLLM()
+    return HFInferenceLLM(
         model_name="meta-llama/Meta-Llama-3.1-8B-Instruct",
         temperature=0.5,
         max_new_tokens=512
     )
-    return RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=vectordb.as_retriever(search_kwargs={"k": 4}),
+
+
+class TimedStuffDocumentsChain(StuffDocumentsChain):
+    """Łańcuch "stuff" z RetrievalQA, który mierzy sklejanie kontekstu (etap prompt_assembly jak w astream_answer)."""
+
+    def _get_inputs(self, docs, **kwargs) -> dict:
+        with metrics.span("prompt_assembly"):
+            return super()._get_inputs(docs, **kwargs)
+
+
+def build_qa_chain(vectordb, llm=None):
+    # To samo co RetrievalQA.from_chain_type(chain_type="stuff"), ale z pomiarem składania promptu
+    combine_chain = TimedStuffDocumentsChain(llm_chain=LLMChain(llm=llm or get_llm(), prompt=PROMPT),
+                                             document_variable_name="context")
+    return RetrievalQA(
+        combine_documents_chain=combine_chain,
+        retriever=AssembledContextRetriever(vectorstore=vectordb, k=RETRIEVER_K),
         return_source_documents=True,
     )
+
+
+def _source_info(doc) -> dict:
+    return {"filename": doc.metadata.get("filename"), "page": doc.metadata.get("page")}
+
+
+async def astream_answer(question: str, k: int = RETRIEVER_K, persist_path="vectorstore/") -> AsyncIterator[tuple[str, object]]:
+    """Odpowiedź strumieniowo: najpierw ("sources", [...]), potem ("token", str) dla każdego tokenu.
+
+    Prompt i kontekst (assemble_context, najwyżej k fragmentów) są te same co w łańcuchu "stuff"
+    z build_qa_chain. Wyszukiwanie i składanie kontekstu (CPU) idą do puli wątków,
+    a generowanie korzysta z asynchronicznego klienta na pętli zdarzeń.
+    Przy domyślnym k odpowiedź z cache jest oddawana od razu jako jeden token.
+    """
+    metrics.inc("rag_queries_total", endpoint="ask")
+    with metrics.trace("ask", question=question):
+        # Pierwsze zapytanie tworzy cache, a z nim embedder (ładowanie modelu) - poza pętlą zdarzeń
+        cache = await asyncio.to_thread(get_answer_cache, persist_path) if k == RETRIEVER_K else None
+        if cache is not None:
+            cached, version = await asyncio.to_thread(cache.get, question)
+            if cached is not None:
+                yield "sources", [_source_info(doc) for doc in cached["source_documents"]]
+                yield "token", cached["result"]
+                return
+        else:
+            version = _checked_version(persist_path)
+
+        # Cała odpowiedź na jednej wersji indeksu - tej, pod którą trafi do cache
+        rows = route_query(question, await asyncio.to_thread(_spec_table_at, persist_path, version))
+        if rows is not None:
+            # Pytanie agregujące/porównanie - do LLM idzie tylko mały wycinek tabeli specyfikacji
+            docs = rows_to_documents(rows)
+            prompt = SPEC_PROMPT.format(table=format_rows(rows), question=question)
+        else:
+            vectordb = await asyncio.to_thread(_vectorstore_at, persist_path, version)
+            docs = await asyncio.to_thread(assemble_context, vectordb, question, k)
+            with metrics.span("prompt_assembly"):
+                prompt = PROMPT.format(context="\n\n".join(doc.page_content for doc in docs), question=question)
+        yield "sources", [_source_info(doc) for doc in docs]
+        tokens = []
+        async for token in get_llm().astream(prompt):
+            tokens.append(token)
+            yield "token", token
+        if cache is not None:
+            await asyncio.to_thread(cache.put, question, {"query": question, "result": "".join(tokens), "source_documents": docs}, version)
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+from pathlib import Path
+from typing import Optional
+
+from langchain.schema import Document
+
+SPEC_TABLE_NAME = "specs.json"
+SPEC_COLUMNS = [
+    "filename", "model", "ram_gb", "storage_gb", "battery_mah", "display_in",
+    "refresh_hz", "main_camera_mp", "weight_g", "sim",
+]
+SPEC_LABELS = {
+    "model": "Model",
+    "ram_gb": "RAM (GB)",
+    "storage_gb": "Pamięć wbudowana (GB)",
+    "battery_mah": "Bateria (mAh)",
+    "display_in": "Ekran (cale)",
+    "refresh_hz": "Odświeżanie (Hz)",
+    "main_camera_mp": "Aparat główny (Mpix)",
+    "weight_g": "Waga (g)",
+    "sim": "SIM",
+}
+MAX_RESULT_ROWS = 5
+
+SPEC_PROMPT = """Odpowiedz na pytanie wyłącznie na podstawie poniższej tabeli specyfikacji telefonów. Jeśli tabela nie zawiera odpowiedzi, powiedz, że nie wiesz.
+
+{table}
+
+Question: {question}
+Helpful Answer:"""
+
+
+def _number(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def _first(pattern: str, text: str) -> Optional[str]:
+    match = re.search(pattern, text, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def _model_name(filename: str) -> str:
+    # galaxy-s25-ultra-5g-dual-sim-... -> Galaxy S25 Ultra
+    stem = Path(filename).stem.lower()
+    parts = re.split(r"-5g-|-dual-|-\d+-?(?:gb|tb)-", stem)[0].split("-")
+    return " ".join(p.upper() if re.fullmatch(r"[a-z]\d+|fe|[a-z]", p) else p.capitalize() for p in parts)
+
+
+def extract_specs(filename: str, text: str) -> dict:
+    """Wyciąga atrybuty z tekstu karty produktu; nazwa pliku (np. ...-256gb-8gb-ram-...) jako zapas."""
+    name = filename.lower()
+    ram = _first(r"ram[^\d\n]{0,25}(\d{1,2})\s*gb", text) or _first(r"(\d{1,2})\s*gb\s+(?:pamięci\s+)?ram", text) \
+        or _first(r"(\d+)gb-ram", name)
+    storage = _first(r"pamięć\s+(?:wbudowana|wewnętrzna)[^\d\n]{0,25}(\d+\s*(?:gb|tb))", text) \
+        or _first(r"(\d+-?(?:gb|tb))-\d+gb-ram", name)
+    if storage:
+        amount = int(re.match(r"\d+", storage).group())
+        storage = amount * 1024 if "t" in storage.lower() else amount
+    sim_text = (text + " " + name.replace("-", " ")).lower()
+    if "dual esim" in sim_text:
+        sim = "Dual eSIM"
+    elif "dual sim" in sim_text:
+        sim = "Dual SIM"
+    else:
+        sim = "eSIM" if "esim" in sim_text else None
+    battery = _first(r"(\d{4,5})\s*mah", text)
+    display = _first(r"(?:ekran|wyświetlacz|przekątna)[^\n]{0,40}?(\d{1,2}[,.]\d{1,2})\s*(?:\"|”|''|cal)", text) \
+        or _first(r"(\d{1,2}[,.]\d{1,2})\s*(?:\"|”|''|cal)", text)
+    refresh = [int(v) for v in re.findall(r"(\d{2,3})\s*hz", text, re.IGNORECASE) if 30 <= int(v) <= 240]
+    camera = [int(v) for v in re.findall(r"(\d{1,3})\s*(?:mpix|mp)\b", text, re.IGNORECASE)]
+    weight = _first(r"waga[^\d\n]{0,25}(\d{2,3})\s*g\b", text)
+    return {
+        "filename": filename,
+        "model": _model_name(filename),
+        "ram_gb": int(ram) if ram else None,
+        "storage_gb": storage,
+        "battery_mah": int(battery) if battery else None,
+        "display_in": _number(display) if display else None,
+        "refresh_hz": max(refresh) if refresh else None,
+        "main_camera_mp": max(camera) if camera else None,
+        "weight_g": int(weight) if weight else None,
+        "sim": sim,
+    }
+
+
+class SpecTable:
+    """Kolumnowa tabela specyfikacji (jedna lista wartości na atrybut, jeden wiersz na plik)."""
+
+    def __init__(self, columns: Optional[dict] = None):
+        self.columns = columns or {name: [] for name in SPEC_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["filename"])
+
+    @classmethod
+    def load(cls, index_dir) -> "SpecTable":
+        table_file = Path(index_dir) / SPEC_TABLE_NAME
+        if not table_file.exists():
+            return cls()
+        with open(table_file, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def save(self, index_dir):
+        table_file = Path(index_dir) / SPEC_TABLE_NAME
+        tmp_file = table_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.columns, f, ensure_ascii=False)
+        os.replace(tmp_file, table_file)
+
+    def row(self, i: int) -> dict:
+        return {name: values[i] for name, values in self.columns.items()}
+
+    def remove(self, filename: str):
+        if filename in self.columns["filename"]:
+            i = self.columns["filename"].index(filename)
+            for values in self.columns.values():
+                del values[i]
+
+    def upsert(self, row: dict):
+        self.remove(row["filename"])
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+
+    def top(self, column: str, descending: bool = True, limit: int = MAX_RESULT_ROWS) -> list[dict]:
+        values = self.columns[column]
+        order = sorted((i for i, v in enumerate(values) if v is not None), key=lambda i: values[i], reverse=descending)
+        # Wszystkie wiersze remisujące z najlepszą wartością, dopiero reszta do limitu
+        leaders = [i for i in order if values[i] == values[order[0]]] if order else []
+        return [self.row(i) for i in order[:max(limit, len(leaders))]]
+
+    def models(self, keys: list[str]) -> list[dict]:
+        return [self.row(i) for i, model in enumerate(self.columns["model"]) if _model_key(model) in keys]
+
+
+class SpecTableBuilder:
+    """Zbiera tekst bieżącego pliku ze strumienia stron i dopisuje wiersz, gdy plik się zmienia."""
+
+    def __init__(self, table: Optional[SpecTable] = None):
+        self.table = table or SpecTable()
+        self._filename = None
+        self._texts = []
+
+    def add(self, doc: Document):
+        filename = doc.metadata.get("filename")
+        if filename != self._filename:
+            self._flush()
+            self._filename = filename
+        self._texts.append(doc.page_content)
+
+    def _flush(self):
+        if self._filename is not None:
+            self.table.upsert(extract_specs(self._filename, "\n".join(self._texts)))
+        self._filename = None
+        self._texts = []
+
+    def finish(self) -> SpecTable:
+        self._flush()
+        return self.table
+
+
+# ---- Routing pytań agregujących i porównań ----
+
+_ATTRIBUTE_KEYWORDS = [
+    ("ram_gb", r"\bram\b|pamięci operacyjnej"),
+    ("storage_gb", r"pamięci wbudowanej|pamięć wbudowan|pamięci wewnętrznej|miejsca na dane|pojemnoś"),
+    ("battery_mah", r"bateri|akumulator"),
+    ("display_in", r"ekran|wyświetlacz"),
+    ("refresh_hz", r"odświeżani|\bhz\b"),
+    ("main_camera_mp", r"aparat|mpix|megapiks"),
+    ("weight_g", r"\bwa[gż]|lekk|lżejsz|cięż"),
+]
+_AGGREGATE = r"\bnaj\w+|ranking|\bktóry\b.*\b(więcej|mniej|większ|mniejsz)"
+_ASCENDING = r"najmniej|najmniejsz|najniższ|najkrótsz|najlżejsz|najlekk"
+_COMPARE = r"\bvs\.?\b|porówna|różnic|różni się|\bczy lepsz|\bversus\b"
+# Atrybuty, których tabela nie ma - na takie pytania odpowiada tylko zwykłe wyszukiwanie
+_NOT_IN_TABLE = r"procesor|chip|snapdragon|exynos|wodoodporn|wodoszczeln|pyłoszczeln|\bip ?6\d|ładowani" \
+    r"|\bcen[aey]\b|kosztuj|kolor|android|system|aktualizacj|\bnfc\b|bluetooth|wi-?fi|głośnik|rysik|\bs pen"
+
+
+def _model_key(model: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", model.lower().replace("+", "plus").replace("galaxy", ""))
+
+
+def _mentioned_models(query: str, table: SpecTable) -> list[str]:
+    # Najdłuższe dopasowania najpierw, żeby "s24 fe" nie zostało policzone też jako "s24"
+    text = _model_key(query)
+    found = []
+    for key in sorted({_model_key(m) for m in table.columns["model"]}, key=len, reverse=True):
+        if key and key in text:
+            found.append(key)
+            text = text.replace(key, " ")
+    return found
+
+
+def query_entities(query: str, table: SpecTable) -> frozenset:
+    """Modele z tabeli i liczby wymienione w pytaniu - klucz zgodności dla cache odpowiedzi."""
+    return frozenset(_mentioned_models(query, table)) | frozenset(re.findall(r"\d+(?:[.,]\d+)?", query))
+
+
+def route_query(query: str, table: SpecTable) -> Optional[list[dict]]:
+    """Wiersze tabeli dla pytań agregujących/porównawczych albo None (wtedy zwykłe wyszukiwanie).
+
+    None także wtedy, gdy pytanie dotyczy atrybutu spoza tabeli albo tabela nie ma dla niego wartości -
+    pusta tabela w prompcie dałaby gorszą odpowiedź niż wyszukiwanie.
+    """
+    if not len(table):
+        return None
+    lowered = query.lower()
+    columns = [column for column, pattern in _ATTRIBUTE_KEYWORDS if re.search(pattern, lowered)]
+    if not columns and re.search(_NOT_IN_TABLE, lowered):
+        return None
+    models = _mentioned_models(query, table)
+    if len(models) >= 2 and (columns or re.search(_COMPARE, lowered)):
+        rows = table.models(models)
+    elif columns and re.search(_AGGREGATE, lowered):
+        rows = table.top(columns[0], descending=not re.search(_ASCENDING, lowered))
+    else:
+        return None
+    if not rows or (columns and all(row[column] is None for row in rows for column in columns)):
+        return None
+    return rows
+
+
+def format_rows(rows: list[dict]) -> str:
+    header = "| " + " | ".join(SPEC_LABELS.values()) + " |"
+    separator = "|" + "---|" * len(SPEC_LABELS)
+    lines = [
+        "| " + " | ".join("brak danych" if row[name] is None else str(row[name]) for name in SPEC_LABELS) + " |"
+        for row in rows
+    ]
+    return "\n".join([header, separator, *lines])
+
+
+def rows_to_documents(rows: list[dict]) -> list[Document]:
+    return [
+        Document(
+            page_content="; ".join(f"{SPEC_LABELS[n]}: {row[n]}" for n in SPEC_LABELS if row[n] is not None),
+            metadata={"filename": row["filename"]},
+        )
+        for row in rows
+    ]
+
+
+class SpecRoutedQAChain:
+    """Pytania agregujące i porównania idą do tabeli specyfikacji (mały wynik do LLM), reszta do RetrievalQA."""
+
+    def __init__(self, chain, table: SpecTable, llm):
+        self.chain = chain
+        self.table = table
+        self.llm = llm
+
+    def __call__(self, query: str) -> dict:
+        rows = route_query(query, self.table)
+        if rows is None:
+            return self.chain(query)
+        answer = self.llm.invoke(SPEC_PROMPT.format(table=format_rows(rows), question=query))
+        return {"query": query, "result": answer, "source_documents": rows_to_documents(rows)}
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+# Moduły projektu leżą płasko w katalogu głównym repozytorium
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rag_pipeline  # noqa: E402
+from fake_inference_server import serve  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Pusty katalog roboczy (vectorstore/, cache/) i deterministyczne embeddingi zamiast modelu z sieci."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_pipeline, "HuggingFaceEmbeddings", lambda model_name: DeterministicFakeEmbedding(size=16))
+    rag_pipeline._resources.clear()
+    rag_pipeline._resource_locks.clear()
+    rag_pipeline._version_checks.clear()
+    yield tmp_path
+    rag_pipeline._resources.clear()
+    rag_pipeline._resource_locks.clear()
+    rag_pipeline._version_checks.clear()
+
+
+@pytest.fixture
+def fake_server():
+    """Fabryka lokalnych serwerów fake_inference_server na wolnym porcie; zwraca (serwer, base_url)."""
+    servers = []
+
+    def start(**kwargs):
+        server = serve(port=0, **kwargs)
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
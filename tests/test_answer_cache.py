@@ -0,0 +1,108 @@
+import zlib
+
+import numpy as np
+
+import answer_cache
+from answer_cache import AnswerCache, CachedQAChain, normalize_query
+
+
+class BagOfWords:
+    """Embedding zależny tylko od zbioru słów - przestawione słowa dają ten sam wektor."""
+
+    def embed_query(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in normalize_query(text).split():
+            vector[zlib.crc32(word.encode()) % 64] += 1
+        return vector.tolist()
+
+
+class Versions:
+    def __init__(self):
+        self.current = "v1"
+
+    def __call__(self):
+        return self.current
+
+
+def _cache(**kwargs):
+    versions = Versions()
+    return AnswerCache(BagOfWords(), versions, **kwargs), versions
+
+
+def _answer(text):
+    return {"result": text, "source_documents": []}
+
+
+def test_exact_hit_after_normalization():
+    cache, _ = _cache()
+    result, version = cache.get("Czy Galaxy Z Flip 6 obsługuje Dual SIM?")
+    assert result is None and version == "v1"
+    cache.put("Czy Galaxy Z Flip 6 obsługuje Dual SIM?", _answer("tak"), version)
+    assert cache.get("  czy galaxy z flip 6   obsługuje dual sim ")[0] == _answer("tak")
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_semantic_hit_only_for_same_entities():
+    cache, _ = _cache()
+    cache.put("Ile waży Galaxy S24?", _answer("167 g"), "v1")
+    assert cache.get("Galaxy S24 ile waży?")[0] == _answer("167 g")
+    assert cache.get("Ile waży Galaxy S25?")[0] is None
+    assert cache.get("Jaki aparat ma Galaxy S24?")[0] is None
+    assert cache.stats()["semantic_hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_custom_entities_fn_guards_models():
+    versions = Versions()
+    cache = AnswerCache(BagOfWords(), versions, entities_fn=lambda q: frozenset({"ultra"} & set(normalize_query(q).split())))
+    cache.put("Ile waży Galaxy S24", _answer("167 g"), "v1")
+    assert cache.get("Ile waży Galaxy S24 Ultra")[0] is None
+
+
+def test_index_version_change_drops_entries():
+    cache, versions = _cache()
+    cache.put("Ile waży Galaxy S24?", _answer("167 g"), "v1")
+    versions.current = "v2"
+    result, version = cache.get("Ile waży Galaxy S24?")
+    assert result is None and version == "v2"
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["size"] == 0
+
+
+def test_answer_from_replaced_version_is_not_stored():
+    cache, versions = _cache()
+    _, version = cache.get("Ile waży Galaxy S24?")
+    versions.current = "v2"  # indeks podmieniony w trakcie generowania odpowiedzi
+    cache.put("Ile waży Galaxy S24?", _answer("stara odpowiedź"), version)
+    assert cache.get("Ile waży Galaxy S24?")[0] is None
+    assert cache.stats()["stale_writes"] == 1
+
+
+def test_ttl_and_lru_eviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache, _ = _cache(max_entries=2, ttl=60)
+    for question in ("Galaxy S21?", "Galaxy S22?", "Galaxy S23?"):
+        cache.put(question, _answer(question), "v1")
+    assert cache.get("Galaxy S21?")[0] is None
+    assert cache.get("Galaxy S23?")[0] == _answer("Galaxy S23?")
+
+    now[0] += 61
+    assert cache.get("Galaxy S23?")[0] is None
+    assert cache.stats()["evictions"] == 3
+
+
+def test_cached_chain_calls_chain_once_per_question():
+    calls = []
+
+    def chain(query):
+        calls.append(query)
+        return {"query": query, **_answer(f"odpowiedź {len(calls)}")}
+
+    cache, versions = _cache()
+    qa = CachedQAChain(chain, cache, version="v1")
+    assert qa("Ile waży Galaxy S24?")["result"] == "odpowiedź 1"
+    assert qa("ile waży galaxy s24")["result"] == "odpowiedź 1"
+    assert calls == ["Ile waży Galaxy S24?"]
+
+    versions.current = "v2"  # łańcuch zbudowany na v1 nie zapisuje już do cache
+    assert qa("Ile waży Galaxy S24?")["result"] == "odpowiedź 2"
+    assert qa("Ile waży Galaxy S24?")["result"] == "odpowiedź 3"
@@ -0,0 +1,75 @@
+import numpy as np
+from langchain.schema import Document
+
+import rag_pipeline as rp
+from context_assembly import (CHARS_PER_TOKEN, Candidate, _normalize, estimate_tokens, merge_adjacent,
+                              retrieve_candidates, select_context)
+
+SHARED = "Pamięć RAM 8 GB, pamięć wbudowana 256 GB, "  # zakładka splittera między kolejnymi chunkami
+
+
+def _candidate(text, vector, score, filename="s24.pdf", page=0):
+    return Candidate(Document(page_content=text, metadata={"filename": filename, "page": page}),
+                     _normalize(np.asarray(vector, dtype=np.float32)), score)
+
+
+def test_merge_adjacent_joins_overlapping_chunks_of_one_page():
+    first = _candidate("Galaxy S24 5G. " + SHARED, [1, 0, 0], 0.6)
+    second = _candidate(SHARED + "bateria 4000 mAh.", [0, 1, 0], 0.8)
+    other_page = _candidate(SHARED + "waga 167 g.", [0, 0, 1], 0.7, page=1)
+    merged = merge_adjacent([first, second, other_page])
+    assert len(merged) == 2
+    assert merged[0].doc.page_content == "Galaxy S24 5G. " + SHARED + "bateria 4000 mAh."
+    assert merged[0].score == 0.8
+    assert merged[1] is other_page
+
+
+def test_merge_adjacent_ignores_short_accidental_overlap():
+    a = _candidate("Ekran 6,2 cala, 120 Hz", [1, 0], 0.5)
+    b = _candidate("120 Hz odświeżanie", [0, 1], 0.4)
+    assert len(merge_adjacent([a, b])) == 2
+
+
+def test_select_context_drops_near_duplicates():
+    spec = "Galaxy S24 8 GB RAM 256 GB bateria 4000 mAh"
+    candidates = [
+        _candidate(spec, [1, 0, 0], 0.9, filename="s24-czarny.pdf"),
+        _candidate(spec, [1, 0.01, 0], 0.89, filename="s24-zolty.pdf"),  # ta sama karta, inny kolor
+        _candidate("Galaxy S24 aparat 50 Mpix", [0.3, 1, 0], 0.7),
+    ]
+    docs = select_context(candidates)
+    assert [doc.metadata["filename"] for doc in docs] == ["s24-czarny.pdf", "s24.pdf"]
+    assert docs[0].metadata["score"] == 0.9
+
+
+def test_select_context_respects_budget_and_max_documents():
+    candidates = [_candidate(f"fragment {i} " * 20, np.eye(6)[i], 0.9 - i / 10) for i in range(6)]
+    tokens = estimate_tokens(candidates[0].doc.page_content)
+    docs = select_context(candidates, token_budget=3 * tokens)
+    assert len(docs) == 3
+    assert len(select_context(candidates, max_documents=2)) == 2
+
+    # Najlepszy fragment większy niż budżet - przycięty, a nie pominięty
+    docs = select_context(candidates, token_budget=10)
+    assert len(docs) == 1 and len(docs[0].page_content) == int(10 * CHARS_PER_TOKEN)
+
+
+def test_ivfpq_candidates_use_exact_vectors(workdir):
+    docs = [Document(page_content=" ".join(f"tel{i} w{j}" for j in range(3000)), metadata={"filename": f"f{i}.md", "page": 0})
+            for i in range(8)]
+    rp.create_vectorstore(docs, index_type="ivfpq")
+    vectordb = rp.load_vectorstore()
+    assert rp.load_index_config()["index_type"] == "ivfpq"
+
+    embedder = rp.get_embedder()
+    hits, misses = embedder.hits, embedder.misses
+    candidates = retrieve_candidates(vectordb, "tel3 w10", fetch_k=8)
+    assert (embedder.hits, embedder.misses) == (hits, misses)  # bez liczenia embeddingów chunków
+
+    query = _normalize(np.asarray(embedder.embed_query("tel3 w10"), dtype=np.float32))
+    exact = {vectordb.index_to_docstore_id[i]: i for i in range(vectordb.exact_index.ntotal)}
+    by_content = {vectordb.docstore.search(doc_id).page_content: pos for doc_id, pos in exact.items()}
+    for candidate in candidates:
+        vector = _normalize(vectordb.exact_index.reconstruct(by_content[candidate.doc.page_content]))
+        assert np.allclose(candidate.vector, vector, atol=1e-6)
+        assert abs(candidate.score - float(vector @ query)) < 1e-5
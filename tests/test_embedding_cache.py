@@ -0,0 +1,106 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_cache import CachedEmbeddings
+
+MODEL = DeterministicFakeEmbedding(size=16)
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def _cache(path, **kwargs):
+    return CachedEmbeddings(CountingEmbeddings(size=16, calls=[]), "fake/model", cache_dir=path, **kwargs)
+
+
+def _texts(prefix, count):
+    return [f"{prefix} chunk {i}" for i in range(count)]
+
+
+def test_only_misses_reach_the_model(tmp_path):
+    cache = _cache(tmp_path)
+    texts = _texts("a", 5)
+    vectors = cache.embed_documents(texts + texts[:2])
+    assert cache.embedder.calls == [texts]  # duplikaty w partii liczone raz
+    assert np.allclose(vectors, MODEL.embed_documents(texts + texts[:2]))
+
+    assert np.allclose(cache.embed_documents(texts[::-1] + ["nowy"]), MODEL.embed_documents(texts[::-1] + ["nowy"]))
+    assert cache.embedder.calls[1:] == [["nowy"]]
+    assert (cache.hits, cache.misses) == (7, 6)
+
+
+def test_cache_persists_across_instances(tmp_path):
+    texts = _texts("b", 50)
+    _cache(tmp_path).embed_documents(texts)
+    cache = _cache(tmp_path)
+    assert np.allclose(cache.embed_documents(texts), MODEL.embed_documents(texts))
+    assert cache.embedder.calls == []
+    assert (tmp_path / "fake__model" / "vectors.f32").exists()
+
+
+def test_snapshot_replaces_journal(tmp_path):
+    # Same trafienia też trafiają do dziennika (czas użycia) - po ~10 tys. wierszy powstaje migawka
+    cache = _cache(tmp_path)
+    texts = _texts("c", 400)
+    for _ in range(30):
+        cache.embed_documents(texts)
+    cache_dir = tmp_path / "fake__model"
+    assert (cache_dir / "index.json").exists()
+    assert len((cache_dir / "journal.log").read_text().splitlines()) < 10_000
+    fresh = _cache(tmp_path)
+    assert np.allclose(fresh.embed_documents(texts), MODEL.embed_documents(texts))
+    assert fresh.embedder.calls == []
+
+
+def test_eviction_keeps_recent_entries(tmp_path):
+    cache = _cache(tmp_path, max_entries=20)
+    old, recent = _texts("stary", 15), _texts("nowy", 15)
+    cache.embed_documents(old)
+    assert np.allclose(cache.embed_documents(recent), MODEL.embed_documents(recent))
+    assert len(cache._entries) <= 20
+
+    calls = len(cache.embedder.calls)
+    assert np.allclose(cache.embed_documents(recent), MODEL.embed_documents(recent))
+    assert len(cache.embedder.calls) == calls
+    assert np.allclose(cache.embed_documents(old), MODEL.embed_documents(old))
+
+
+def test_truncated_journal_line_is_dropped(tmp_path):
+    texts = _texts("d", 10)
+    _cache(tmp_path).embed_documents(texts)
+    with open(tmp_path / "fake__model" / "journal.log", "ab") as f:
+        f.write(b"0123abcd 99")  # zapis przerwany w połowie wiersza
+    cache = _cache(tmp_path)
+    assert np.allclose(cache.embed_documents(texts + ["e"]), MODEL.embed_documents(texts + ["e"]))
+    assert cache.embedder.calls == [["e"]]
+    assert np.allclose(_cache(tmp_path).embed_documents(["e"]), MODEL.embed_documents(["e"]))
+
+
+def _worker(path, seed):
+    # Nakładające się partie z wielu procesów, z limitem wymuszającym eviction i migawki
+    rng = np.random.default_rng(seed)
+    cache = _cache(path, max_entries=300)
+    for _ in range(25):
+        texts = [f"wspólny chunk {i}" for i in rng.integers(0, 600, size=40)]
+        if not np.allclose(cache.embed_documents(texts), MODEL.embed_documents(texts)):
+            return False
+    return True
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="wymaga fork")
+def test_concurrent_processes_share_cache(tmp_path):
+    with ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context("fork")) as executor:
+        results = list(executor.map(_worker, [tmp_path] * 8, range(8)))
+    assert all(results)
+    cache = _cache(tmp_path, max_entries=300)
+    assert len(cache.embed_documents(["wspólny chunk 1"])) == 1
+    assert len(cache._entries) <= 300
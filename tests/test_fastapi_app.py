@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain.schema import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import fastapi_app
+import rag_pipeline as rp
+from ingest_jobs import IngestQueue
+
+
+@pytest.fixture
+def api(workdir, monkeypatch):
+    """Aplikacja na pustym katalogu roboczym: własna kolejka zadań i katalog uploadów."""
+    upload_dir = workdir / "data" / "docs"
+    upload_dir.mkdir(parents=True)
+    monkeypatch.setattr(fastapi_app, "UPLOAD_DIR", upload_dir)
+    monkeypatch.setattr(fastapi_app, "ingest_queue", IngestQueue())
+    return upload_dir
+
+
+def _wait_for_job(client, job_id, timeout=30.0):
+    end = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        assert time.monotonic() < end, job
+        time.sleep(0.02)
+
+
+def _upload(client, name, text):
+    return client.post("/upload/", files={"file": (name, text.encode("utf-8"), "text/markdown")})
+
+
+def test_upload_replace_and_delete(api):
+    with TestClient(fastapi_app.app) as client:
+        response = _upload(client, "galaxy-s24.md", "Galaxy S24 RAM 8 GB bateria 4000 mAh. " * 20)
+        assert response.status_code == 202
+        assert _wait_for_job(client, response.json()["job_id"])["result"] == "added"
+        assert (api / "galaxy-s24.md").exists()
+        assert "galaxy-s24.md" in rp.load_manifest()["files"]
+
+        response = client.put("/documents/galaxy-s24.md",
+                              files={"file": ("x.md", "Galaxy S24 RAM 8 GB bateria 4100 mAh. ".encode() * 20)})
+        assert _wait_for_job(client, response.json()["job_id"])["result"] == "replaced"
+        assert "4100" in (api / "galaxy-s24.md").read_text(encoding="utf-8")
+
+        response = client.delete("/documents/galaxy-s24.md")
+        assert _wait_for_job(client, response.json()["job_id"])["result"] is True
+        assert not (api / "galaxy-s24.md").exists()
+        assert client.delete("/documents/galaxy-s24.md").status_code == 404
+    assert not list(api.glob("*.part"))
+
+
+def test_same_name_uploads_are_installed_in_order(api):
+    with TestClient(fastapi_app.app) as client:
+        jobs = [_upload(client, "a.md", f"wersja {i} " * 50).json()["job_id"] for i in range(3)]
+        assert [_wait_for_job(client, job_id)["status"] for job_id in jobs] == ["done"] * 3
+        assert (api / "a.md").read_text(encoding="utf-8").startswith("wersja 2")
+    assert not list(api.glob("*.part"))
+
+
+def test_full_queue_rejects_upload_without_touching_files(api, monkeypatch):
+    # Kolejka bez workera (bez lifespan) - pierwsze zadanie ją zapełnia
+    monkeypatch.setattr(fastapi_app, "ingest_queue", IngestQueue(maxsize=1))
+    (api / "b.md").write_text("oryginał", encoding="utf-8")
+    client = TestClient(fastapi_app.app)
+    assert _upload(client, "a.md", "pierwszy").status_code == 202
+
+    assert _upload(client, "c.md", "drugi").status_code == 503
+    response = client.put("/documents/b.md", files={"file": ("b.md", b"nowa wersja")})
+    assert response.status_code == 503
+    assert not (api / "c.md").exists()
+    assert (api / "b.md").read_text(encoding="utf-8") == "oryginał"
+    assert len(list(api.glob("*.part"))) == 1  # tylko plik przyjętego zadania, jeszcze nie zainstalowany
+
+
+def _events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+@pytest.fixture
+def stub_index(workdir, monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "stub")
+    rp.create_vectorstore([Document(page_content=" ".join(f"Galaxy S2{i} bateria {4000 + i} mAh zdanie {j}." for j in range(80)),
+                                    metadata={"filename": f"galaxy-s2{i}.md", "page": 0}) for i in range(3)])
+
+
+def test_ask_streams_sources_tokens_done(stub_index):
+    client = TestClient(fastapi_app.app)
+    events = _events(client.get("/ask", params={"question": "Jaka bateria ma Galaxy S21?", "k": 2}))
+    names = [event for event, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert set(names[1:-1]) == {"token"} and len(names) > 3
+    assert 1 <= len(events[0][1]) <= 2
+    assert all(source["filename"].startswith("galaxy-s2") for source in events[0][1])
+    assert "".join(data for event, data in events if event == "token").endswith("Jaka bateria ma Galaxy S21?")
+
+
+def test_ask_answers_repeated_question_from_cache(stub_index):
+    client = TestClient(fastapi_app.app)
+    first = _events(client.get("/ask", params={"question": "Ile mAh ma Galaxy S22?"}))
+    second = _events(client.get("/ask", params={"question": "Ile mAh ma Galaxy S22?"}))
+    assert [event for event, _ in second] == ["sources", "token", "done"]
+    assert second[1][1] == "".join(data for event, data in first if event == "token")
+    assert client.get("/cache/stats").json()["hits"] == 1
+
+
+@pytest.mark.parametrize("params, status", [
+    ({"question": "Galaxy S21?", "k": 0}, 422),
+    ({"question": "Galaxy S21?", "k": fastapi_app.MAX_K + 1}, 422),
+    ({"question": "Galaxy S21?", "k": "dużo"}, 422),
+    ({"question": "   "}, 400),
+])
+def test_ask_validates_params(stub_index, params, status):
+    assert TestClient(fastapi_app.app).get("/ask", params=params).status_code == status
+
+
+def test_ask_loads_embedder_off_event_loop(stub_index, monkeypatch):
+    on_loop = []
+
+    def embedder(model_name):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return DeterministicFakeEmbedding(size=16)
+
+    rp._resources.clear()
+    monkeypatch.setattr(rp, "HuggingFaceEmbeddings", embedder)
+    events = _events(TestClient(fastapi_app.app).get("/ask", params={"question": "Ile mAh ma Galaxy S20?"}))
+    assert events[-1][0] == "done"
+    assert on_loop == [False]
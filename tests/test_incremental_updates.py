@@ -0,0 +1,114 @@
+import rag_pipeline as rp
+from langchain.schema import Document
+
+
+def _doc(filename, text, words=60):
+    return Document(page_content=" ".join(f"{text} w{i}" for i in range(words)), metadata={"filename": filename, "page": 0})
+
+
+def _phone(i, words=60):
+    return _doc(f"galaxy-s2{i}-5g-dual-sim-256gb-12gb-ram.md", f"Galaxy S2{i} RAM 12 GB", words)
+
+
+def _ntotal():
+    return rp.load_vectorstore().index.ntotal
+
+
+def _filenames():
+    vectordb = rp.load_vectorstore()
+    return sorted({vectordb.docstore.search(i).metadata["filename"] for i in vectordb.index_to_docstore_id.values()})
+
+
+def _write_docs(folder, texts):
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, text in texts.items():
+        (folder / name).write_text(text, encoding="utf-8")
+
+
+def test_upsert_added_unchanged_replaced(workdir):
+    assert rp.upsert_documents("a.md", [_doc("a.md", "alfa")]) == "added"
+    assert rp.upsert_documents("b.md", [_doc("b.md", "beta")]) == "added"
+    version = rp.index_version()
+
+    assert rp.upsert_documents("a.md", [_doc("a.md", "alfa")]) == "unchanged"
+    assert rp.index_version() == version
+
+    assert rp.upsert_documents("a.md", [_doc("a.md", "alfa nowa", words=120)]) == "replaced"
+    manifest = rp.load_manifest()["files"]
+    assert sorted(manifest) == ["a.md", "b.md"]
+    assert _ntotal() == sum(len(entry["chunk_ids"]) for entry in manifest.values())
+    assert _filenames() == ["a.md", "b.md"]
+
+
+def test_manifest_vector_ids_follow_positions(workdir):
+    for name in ("a.md", "b.md", "c.md"):
+        rp.upsert_documents(name, [_doc(name, name)])
+    rp.delete_document("a.md")
+    vectordb = rp.load_vectorstore()
+    for name, entry in rp.load_manifest()["files"].items():
+        assert [vectordb.index_to_docstore_id[pos] for pos in entry["vector_ids"]] == entry["chunk_ids"]
+
+
+def test_delete_document(workdir):
+    rp.create_vectorstore([_phone(0), _phone(1)])
+    assert len(rp.get_spec_table()) == 2
+    assert rp.delete_document(_phone(0).metadata["filename"])
+    rp._version_checks.clear()
+    assert _filenames() == [_phone(1).metadata["filename"]]
+    assert rp.get_spec_table().columns["model"] == ["Galaxy S21"]
+    assert not rp.delete_document("brak.md")
+
+
+def test_legacy_index_is_migrated_before_incremental_writes(workdir):
+    # Układ sprzed wersjonowania i manifestu: save_local wprost do vectorstore/
+    docs = [_phone(i, words=200) for i in range(3)]
+    chunks = rp._get_splitter().split_documents(docs)
+    rp.FAISS.from_documents(chunks, rp.get_embedder()).save_local("vectorstore/")
+    total = _ntotal()
+    assert sorted(rp.load_manifest()["files"]) == sorted(d.metadata["filename"] for d in docs)
+
+    assert rp.upsert_documents(docs[0].metadata["filename"], [docs[0]]) == "replaced"
+    assert _ntotal() == total
+    assert len(rp.get_spec_table()) == 3
+
+    assert rp.delete_document(docs[1].metadata["filename"])
+    rp._version_checks.clear()
+    assert len(rp.get_spec_table()) == 2
+    assert docs[1].metadata["filename"] not in _filenames()
+
+
+def test_sync_skips_unchanged_files_without_parsing(workdir, monkeypatch):
+    docs = workdir / "docs"
+    _write_docs(docs, {"a.md": "alfa " * 100, "b.md": "beta " * 100})
+    assert rp.sync_vectorstore(docs) == {"a.md": "added", "b.md": "added"}
+    assert all(entry["file_hash"] for entry in rp.load_manifest()["files"].values())
+    version = rp.index_version()
+
+    parsed = []
+    load_file = rp.load_file
+    monkeypatch.setattr(rp, "load_file", lambda path: parsed.append(path.name) or load_file(path))
+    assert rp.sync_vectorstore(docs) == {"a.md": "unchanged", "b.md": "unchanged"}
+    assert parsed == [] and rp.index_version() == version
+
+    (docs / "b.md").write_text("beta " * 100 + "\n", encoding="utf-8")  # inne bajty, ta sama treść
+    assert rp.sync_vectorstore(docs)["b.md"] == "unchanged"
+    assert parsed == ["b.md"] and rp.index_version() == version
+
+
+def test_sync_publishes_all_changes_as_one_version(workdir):
+    docs = workdir / "docs"
+    _write_docs(docs, {"a.md": "alfa " * 100, "b.md": "beta " * 100, "c.md": "gamma " * 100})
+    rp.sync_vectorstore(docs)
+    versions = len(list((workdir / "vectorstore" / rp.VERSIONS_DIR).iterdir()))
+
+    (docs / "a.md").unlink()
+    _write_docs(docs, {"b.md": "beta nowa " * 150, "d.md": "delta " * 100})
+    assert rp.sync_vectorstore(docs) == {"a.md": "deleted", "b.md": "replaced", "c.md": "unchanged", "d.md": "added"}
+    assert len(list((workdir / "vectorstore" / rp.VERSIONS_DIR).iterdir())) == versions + 1
+
+    manifest = rp.load_manifest()["files"]
+    assert sorted(manifest) == ["b.md", "c.md", "d.md"] == _filenames()
+    assert _ntotal() == sum(len(entry["chunk_ids"]) for entry in manifest.values())
+    vectordb = rp.load_vectorstore()
+    for entry in manifest.values():
+        assert [vectordb.index_to_docstore_id[pos] for pos in entry["vector_ids"]] == entry["chunk_ids"]
@@ -0,0 +1,58 @@
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+import rag_pipeline as rp
+
+
+def _doc(filename, text, words=60):
+    return Document(page_content=" ".join(f"{text} w{i}" for i in range(words)), metadata={"filename": filename, "page": 0})
+
+
+@pytest.mark.parametrize("index_type, index_class", [("flat", faiss.IndexFlat), ("hnsw", faiss.IndexHNSWFlat)])
+def test_serving_index_type_is_memory_mapped(workdir, index_type, index_class):
+    rp.create_vectorstore([_doc(f"f{i}.md", f"tel{i}") for i in range(4)], index_type=index_type)
+    config = rp.load_index_config()
+    assert config["index_type"] == index_type and config["ntotal"] == rp._load_for_update(rp.current_index_dir()).index.ntotal
+    vectordb = rp.load_vectorstore()
+    assert isinstance(vectordb.index, index_class)
+    vectors = vectordb.exact_index.reconstruct_n(0, vectordb.exact_index.ntotal)
+    _, found = vectordb.index.search(vectors, 1)
+    assert list(found[:, 0]) == list(range(len(vectors)))
+
+
+def test_unknown_index_type_is_rejected(workdir):
+    with pytest.raises(ValueError):
+        rp.create_vectorstore([_doc("a.md", "alfa")], index_type="lsh")
+
+
+def test_ivfpq_is_updated_in_place(workdir):
+    rp.create_vectorstore([_doc(f"f{i}.md", f"tel{i}", words=3000) for i in range(8)], index_type="ivfpq")
+    config = rp.load_index_config()
+    assert config["index_type"] == "ivfpq" and config["requested"]["index_type"] == "ivfpq"
+    assert 2 ** config["params"]["nbits"] * 39 <= config["ntotal"]
+
+    rp.upsert_documents("f2.md", [_doc("f2.md", "tel2 nowy", words=2000)])
+    rp.delete_document("f0.md")
+    rp.upsert_documents("f9.md", [_doc("f9.md", "tel9", words=500)])
+
+    flat = rp._load_for_update(rp.current_index_dir()).index
+    serving = rp.load_vectorstore().index
+    assert rp.load_index_config()["params"] == config["params"]  # bez ponownego treningu
+    assert serving.ntotal == flat.ntotal
+    # Id w listach IVF to pozycje w płaskim indeksie (i docstore) - każdy wektor znajduje sam siebie
+    ivf = faiss.extract_index_ivf(serving)
+    ivf.nprobe = ivf.nlist
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    _, found = serving.search(vectors, 1)
+    assert (found[:, 0] == np.arange(flat.ntotal)).mean() > 0.95
+
+
+def test_small_ivfpq_request_records_flat_fallback(workdir):
+    rp.create_vectorstore([_doc("a.md", "alfa")], index_type="ivfpq")
+    config = rp.load_index_config()
+    assert config["index_type"] == "flat" and config["params"] == {}
+    assert config["requested"]["index_type"] == "ivfpq"
+    rp.upsert_documents("b.md", [_doc("b.md", "beta", words=30000)])
+    assert rp.load_index_config()["index_type"] == "ivfpq"
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+from langchain.schema import Document
+
+import rag_pipeline as rp
+
+
+def _doc(filename, text, words=60):
+    return Document(page_content=" ".join(f"{text} w{i}" for i in range(words)), metadata={"filename": filename, "page": 0})
+
+
+def test_version_swap_and_cleanup(workdir):
+    rp.create_vectorstore([_doc("a.md", "alfa")])
+    old_version = rp.index_version()
+    old_db = rp.get_vectorstore()
+    rp.upsert_documents("b.md", [_doc("b.md", "beta")])
+
+    new_version = rp.index_version()
+    assert new_version > old_version
+    assert (rp.Path("vectorstore") / rp.CURRENT_NAME).read_text(encoding="utf-8") == new_version
+    # Czytelnik starej wersji dalej działa; po sprawdzeniu CURRENT dostaje nową
+    assert old_db.similarity_search("alfa", k=1)
+    rp._version_checks.clear()
+    assert rp.get_vectorstore() is not old_db
+    assert rp.get_vectorstore().index.ntotal > old_db.index.ntotal
+
+    for i in range(rp.KEEP_VERSIONS + 2):
+        rp.upsert_documents(f"c{i}.md", [_doc(f"c{i}.md", f"gamma {i}")])
+    versions = sorted(os.listdir("vectorstore/versions"))
+    assert len(versions) == rp.KEEP_VERSIONS
+    assert versions[-1] == rp.index_version()
+
+
+def test_failed_write_keeps_current_version(workdir, monkeypatch):
+    rp.create_vectorstore([_doc("a.md", "alfa")])
+    version = rp.index_version()
+
+    def fail(*args, **kwargs):
+        raise OSError("dysk pełny")
+
+    monkeypatch.setattr(rp, "_save_version", fail)
+    with pytest.raises(OSError):
+        rp.upsert_documents("b.md", [_doc("b.md", "beta")])
+    assert rp.index_version() == version
+    assert os.listdir("vectorstore/versions") == [version]
+    assert sorted(rp.load_manifest()["files"]) == ["a.md"]
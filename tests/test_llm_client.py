@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import llm_client
+from llm_client import LLMDeadlineExceeded, _Slots
+from rag_pipeline import HFInferenceLLM
+
+
+def _llm(base_url, **kwargs):
+    return HFInferenceLLM(model_name="fake", base_url=base_url, **kwargs)
+
+
+def test_identical_sync_calls_are_coalesced(fake_server):
+    server, url = fake_server(latency=0.5)
+    llm = _llm(url)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def ask():
+        barrier.wait()
+        results.append(llm.invoke("Czy Galaxy S24 ma Dual SIM?"))
+
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4 and len(set(results)) == 1
+    assert server.fake.stats["requests"] == 1
+
+
+def test_identical_async_calls_are_coalesced(fake_server):
+    server, url = fake_server(latency=0.3)
+    llm = _llm(url)
+
+    async def main():
+        return await asyncio.gather(*(llm.ainvoke("To samo pytanie") for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert len(set(results)) == 1
+    assert server.fake.stats["requests"] == 1
+
+
+def test_different_prompts_are_not_coalesced(fake_server):
+    server, url = fake_server(latency=0.1)
+    llm = _llm(url)
+    llm.invoke("pierwsze")
+    llm.invoke("drugie")
+    assert server.fake.stats["requests"] == 2
+
+
+def test_retry_honours_retry_after(fake_server, monkeypatch):
+    server, url = fake_server(latency=0.0, fail_status=429, retry_after=0.3)
+    monkeypatch.setattr(llm_client, "BACKOFF_BASE", 0.001)  # przerwa wynika tylko z Retry-After
+    fake = server.fake
+    calls = iter([True])
+
+    def fail_first():
+        with fake._lock:
+            fake.stats["requests"] += 1
+            if next(calls, False):
+                fake.stats["failures"] += 1
+                return False
+            fake.stats["active"] += 1
+            return True
+
+    fake.enter = fail_first
+    start = time.monotonic()
+    answer = _llm(url, max_retries=2).invoke("pytanie")
+    assert answer.startswith("Odpowiedź testowa")
+    assert time.monotonic() - start >= 0.3
+    assert fake.stats["requests"] == 2 and fake.stats["failures"] == 1
+
+
+def test_non_retryable_status_is_raised_at_once(fake_server):
+    server, url = fake_server(latency=0.0, fail_rate=1.0, fail_status=400)
+    with pytest.raises(Exception):
+        _llm(url, max_retries=3).invoke("pytanie")
+    assert server.fake.stats["requests"] == 1
+
+
+def test_sync_call_respects_deadline(fake_server):
+    _, url = fake_server(latency=2.0)
+    llm = _llm(url, deadline=0.5, max_retries=0)
+    start = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        llm.invoke("pytanie")
+    assert time.monotonic() - start < 1.5
+
+
+def test_sync_stream_respects_deadline(fake_server):
+    _, url = fake_server(latency=2.0)
+    llm = _llm(url, deadline=0.5, max_retries=0)
+    start = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        list(llm.stream("pytanie"))
+    assert time.monotonic() - start < 1.5
+
+
+def test_async_call_respects_deadline(fake_server):
+    _, url = fake_server(latency=2.0)
+    llm = _llm(url, deadline=0.5, max_retries=0)
+    start = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(llm.ainvoke("pytanie"))
+    assert time.monotonic() - start < 1.5
+
+
+def test_concurrency_limit_is_enforced(fake_server):
+    server, url = fake_server(latency=0.2)
+    llm = _llm(url, max_concurrency=2, coalesce=False)
+    threads = [threading.Thread(target=llm.invoke, args=(f"pytanie {i}",)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.fake.stats["requests"] == 6
+    assert server.fake.stats["max_active"] <= 2
+
+
+def _wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "warunek nie został spełniony w czasie"
+        time.sleep(0.005)
+
+
+def test_slots_hand_off_in_fifo_order():
+    slots = _Slots(1)
+    assert slots.acquire(0)
+    order = []
+
+    def waiter(name):
+        assert slots.acquire(5)
+        order.append(name)
+
+    threads = []
+    for i, name in enumerate("abc"):
+        threads.append(threading.Thread(target=waiter, args=(name,)))
+        threads[-1].start()
+        _wait_until(lambda: slots.queued == i + 1)
+
+    for i in range(3):
+        slots.release()
+        _wait_until(lambda: len(order) == i + 1)
+        # Zwolniony slot przechodzi wprost na czekającego - licznik aktywnych się nie zmienia
+        assert slots.active == 1
+    for thread in threads:
+        thread.join()
+    slots.release()
+    assert order == ["a", "b", "c"]
+    assert slots.active == 0 and slots.queued == 0
+
+
+def test_slots_timeout_leaves_queue():
+    slots = _Slots(1)
+    assert slots.acquire(0)
+    assert not slots.acquire(0.05)
+    assert slots.queued == 0
+    slots.release()
+    assert slots.active == 0
+
+
+def test_slots_hand_off_between_threads_and_event_loop():
+    slots = _Slots(1)
+    assert slots.acquire(0)
+
+    async def main():
+        task = asyncio.ensure_future(slots.aacquire(5))
+        await asyncio.sleep(0.05)
+        assert slots.queued == 1
+        threading.Timer(0.05, slots.release).start()
+        assert await task
+
+    asyncio.run(main())
+    assert slots.active == 1
+    slots.release()
+    assert slots.active == 0
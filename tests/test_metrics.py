@@ -0,0 +1,24 @@
+from langchain.schema import Document
+
+import metrics
+import rag_pipeline as rp
+
+
+def test_stuff_chain_records_query_stages(workdir):
+    rp.create_vectorstore([Document(page_content="Galaxy S24 bateria 4000 mAh. " * 40, metadata={"filename": "s24.md", "page": 0})])
+    chain = rp.build_qa_chain(rp.load_vectorstore(), llm=rp.LocalStubLLM())
+    with metrics.trace("query") as spans:
+        result = chain.invoke({"query": "Ile mAh ma Galaxy S24?"})
+    assert result["result"].endswith("Ile mAh ma Galaxy S24?")
+    stages = [stage for stage, _ in spans]
+    assert stages.index("retrieval") < stages.index("context_assembly") < stages.index("prompt_assembly")
+    assert 'rag_stage_seconds_count{stage="prompt_assembly"}' in metrics.render()
+
+
+def test_render_includes_counters_and_collectors(monkeypatch):
+    monkeypatch.setattr(metrics, "_collectors", list(metrics._collectors))
+    metrics.inc("rag_test_total", 2, endpoint="ask")
+    metrics.register_collector(lambda: {"rag_test_gauge": 7})
+    text = metrics.render()
+    assert 'rag_test_total{endpoint="ask"} 2' in text
+    assert "rag_test_gauge 7" in text
@@ -0,0 +1,110 @@
+import pytest
+from langchain.schema import Document
+
+from spec_table import SpecTable, SpecTableBuilder, MAX_RESULT_ROWS, extract_specs, route_query, query_entities
+
+S24_TEXT = """Samsung Galaxy S24 5G
+Wyświetlacz: 6,2" Dynamic AMOLED 2X, odświeżanie 120 Hz
+Pamięć RAM: 8 GB
+Pamięć wbudowana: 256 GB
+Aparat główny 50 Mpix, szerokokątny 12 Mpix
+Bateria 4000 mAh
+Waga: 167 g
+Dual SIM (nano SIM + eSIM)"""
+
+
+def _table(*rows):
+    table = SpecTable()
+    for row in rows:
+        table.upsert(row)
+    return table
+
+
+def _row(model, **values):
+    return {"filename": f"{model.lower().replace(' ', '-')}.pdf", "model": model, **values}
+
+
+PHONES = _table(
+    _row("Galaxy S24", ram_gb=8, weight_g=167),
+    _row("Galaxy S25", ram_gb=12, weight_g=162),
+    _row("Galaxy S24 Ultra", ram_gb=12, weight_g=232),
+    _row("Galaxy Z Fold6", ram_gb=12, weight_g=239),
+)
+
+
+def test_extract_specs_from_product_sheet():
+    specs = extract_specs("galaxy-s24-5g-dual-sim-256gb-8gb-ram-czarny.pdf", S24_TEXT)
+    assert specs == {
+        "filename": "galaxy-s24-5g-dual-sim-256gb-8gb-ram-czarny.pdf",
+        "model": "Galaxy S24",
+        "ram_gb": 8,
+        "storage_gb": 256,
+        "battery_mah": 4000,
+        "display_in": 6.2,
+        "refresh_hz": 120,
+        "main_camera_mp": 50,
+        "weight_g": 167,
+        "sim": "Dual SIM",
+    }
+
+
+def test_extract_specs_falls_back_to_filename():
+    specs = extract_specs("galaxy-z-flip6-5g-dual-sim-1tb-12gb-ram.pdf", "Brak tabeli parametrów.")
+    assert specs["model"] == "Galaxy Z Flip6"
+    assert (specs["ram_gb"], specs["storage_gb"], specs["sim"]) == (12, 1024, "Dual SIM")
+    assert specs["battery_mah"] is None
+
+
+def test_builder_collects_pages_per_file():
+    builder = SpecTableBuilder()
+    for i, line in enumerate(S24_TEXT.splitlines()):
+        builder.add(Document(page_content=line, metadata={"filename": "galaxy-s24-5g-8gb-ram.pdf", "page": i}))
+    table = builder.finish()
+    assert len(table) == 1 and table.row(0)["battery_mah"] == 4000
+
+
+def test_aggregate_returns_all_rows_tied_with_top():
+    models = ["S24", "S24+", "S24 Ultra", "S25", "S25+", "S25 Ultra", "Z Flip6", "Z Fold6"]
+    table = _table(*(_row(f"Galaxy {m}", ram_gb=12) for m in models), _row("Galaxy A55", ram_gb=8))
+    rows = route_query("Który telefon ma najwięcej pamięci RAM?", table)
+    assert len(rows) == len(models) > MAX_RESULT_ROWS
+    assert {row["ram_gb"] for row in rows} == {12}
+    assert route_query("Który telefon ma najwięcej pamięci RAM?", PHONES)[0]["ram_gb"] == 12
+
+
+def test_aggregate_ascending():
+    rows = route_query("Który Galaxy jest najlżejszy?", PHONES)
+    assert rows[0]["model"] == "Galaxy S25"
+
+
+def test_aggregate_without_values_falls_back_to_retrieval():
+    assert route_query("Który telefon ma największą baterię?", PHONES) is None
+
+
+@pytest.mark.parametrize("query", [
+    "Porównaj Galaxy S24 i S25",
+    "Galaxy S24 vs Galaxy S25",
+    "Czy Galaxy S24 i S25 różnią się wagą?",
+    "Ile RAM mają Galaxy S24 i S25?",
+])
+def test_comparisons_route_to_table(query):
+    assert sorted(row["model"] for row in route_query(query, PHONES)) == ["Galaxy S24", "Galaxy S25"]
+
+
+@pytest.mark.parametrize("query", [
+    "Jaki procesor mają Galaxy S24 i S25?",
+    "Czy S24 Ultra i Z Fold6 są wodoodporne?",
+    "Porównaj procesor Galaxy S24 vs S25",
+    "Czy Galaxy S24 i S25 mają taką samą baterię?",  # kolumna bez wartości w tabeli
+    "Czy Galaxy S24 obsługuje Dual SIM?",
+    "Co to jest tryb nocny?",
+])
+def test_other_questions_go_to_retrieval(query):
+    assert route_query(query, PHONES) is None
+
+
+def test_query_entities_distinguish_models():
+    s24 = query_entities("Czy Galaxy S24 obsługuje Dual SIM?", PHONES)
+    s25 = query_entities("czy galaxy s25 obsługuje dual sim", PHONES)
+    assert s24 != s25
+    assert s24 == query_entities("Galaxy S24 - czy ma Dual SIM?", PHONES)